@@ -0,0 +1,94 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, Dict, Optional
+
+from cachetools import TTLCache
+
+from api_handler import api_handler
+from marzban_api_handler import marzban_handler
+from config import ACCOUNT_LOOKUP_DEADLINE, ACCOUNT_CACHE_TTL, ACCOUNT_CACHE_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+class MergedAccountService:
+    """
+    Builds the combined Hiddify + Marzban view of one account for fmt_one.
+
+    Both panels are queried at the same time under one shared deadline, so a view costs the
+    slower of the two lookups rather than their sum. Hiddify is required; if Marzban misses
+    the deadline or fails, the account is shown without its Marzban part. Only complete
+    results are cached (per UUID, for `ttl` seconds).
+    """
+
+    def __init__(self, hiddify=api_handler, marzban=marzban_handler, deadline: float = ACCOUNT_LOOKUP_DEADLINE,
+                 ttl: float = ACCOUNT_CACHE_TTL, maxsize: int = ACCOUNT_CACHE_SIZE):
+        self.hiddify = hiddify
+        self.marzban = marzban
+        self.deadline = deadline
+        self._cache: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="account-lookup")
+
+    def get(self, uuid: str) -> Optional[Dict[str, Any]]:
+        uuid = uuid.lower()
+        with self._lock:
+            cached = self._cache.get(uuid)
+        if cached is not None:
+            return cached
+
+        started = time.monotonic()
+        h_future = self._executor.submit(self.hiddify.user_info, uuid)
+        m_future = self._executor.submit(self.marzban.get_user_info, uuid) if self.marzban.enabled else None
+        wait([f for f in (h_future, m_future) if f], timeout=self.deadline)
+
+        h_info = self._result(h_future, "Hiddify", uuid)
+        if not h_info:
+            return None
+        m_info, complete = None, True
+        if m_future is not None:
+            complete = m_future.done()
+            m_info = self._result(m_future, "Marzban", uuid)
+        merged = self._merge(h_info, m_info)
+        logger.debug(f"Account view for {uuid} built in {time.monotonic() - started:.2f}s (complete={complete})")
+
+        if complete:
+            with self._lock:
+                self._cache[uuid] = merged
+        return merged
+
+    def invalidate(self, uuid: str) -> None:
+        with self._lock:
+            self._cache.pop(uuid.lower(), None)
+
+    def _result(self, future, panel: str, uuid: str) -> Optional[Dict[str, Any]]:
+        if not future.done():
+            logger.warning(f"{panel} lookup for {uuid} missed the {self.deadline}s deadline.")
+            return None
+        try:
+            return future.result()
+        except Exception as e:
+            logger.error(f"{panel} lookup for {uuid} failed: {e}")
+            return None
+
+    @staticmethod
+    def _merge(h_info: Dict[str, Any], m_info: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        merged = dict(h_info)
+        merged['breakdown'] = {'hiddify': {'usage': h_info.get('current_usage_GB', 0), 'limit': h_info.get('usage_limit_GB', 0)}}
+        if not m_info:
+            return merged
+
+        m_usage, m_limit = m_info.get('current_usage_GB', 0), m_info.get('usage_limit_GB', 0)
+        merged['breakdown']['marzban'] = {'usage': m_usage, 'limit': m_limit}
+        merged['current_usage_GB'] = h_info.get('current_usage_GB', 0) + m_usage
+        merged['usage_limit_GB'] = h_info.get('usage_limit_GB', 0) + m_limit
+        merged['remaining_GB'] = max(0, merged['usage_limit_GB'] - merged['current_usage_GB'])
+        merged['usage_percentage'] = (merged['current_usage_GB'] / merged['usage_limit_GB'] * 100) if merged['usage_limit_GB'] > 0 else 0
+        last_seen = [dt for dt in (h_info.get('last_online'), m_info.get('last_online')) if dt]
+        merged['last_online'] = max(last_seen) if last_seen else None
+        return merged
+
+
+account_service = MergedAccountService()
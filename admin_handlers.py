@@ -3,14 +3,16 @@ import time
 from telebot import types, telebot
 from database import db
 from api_handler import api_handler
+from account_service import account_service
 from menu import menu
 from formatters import (
     fmt_one, fmt_users_list, fmt_panel_info, fmt_top_consumers,
-    fmt_online_users_list, fmt_bot_users_list, fmt_birthdays_list
+    fmt_online_users_list, fmt_bot_users_list, fmt_birthdays_list, fmt_api_stats, fmt_db_stats
 )
 from utils import escape_markdown
 from datetime import datetime
-from config import ADMIN_IDS, DATABASE_PATH, TELEGRAM_FILE_SIZE_LIMIT_BYTES
+from config import ADMIN_IDS, DATABASE_PATH
+from backup import create_backup, remove_backup
 import os
 from telebot.apihelper import ApiTelegramException
 
@@ -158,8 +160,7 @@ def _handle_user_search(message: types.Message):
         return
         
     bot.send_message(uid, "⏳ در حال جستجو\\.\\.\\.") 
-    all_users = api_handler.get_all_users()
-    found_user = next((u for u in all_users if u['uuid'] == query or query in u['name'].lower()), None)
+    found_user = api_handler.find_user(query)
     
     if found_user:
         uuid = found_user['uuid']
@@ -256,6 +257,7 @@ def _apply_user_edit(msg: types.Message):
             add_days = int(value)
             
         if api_handler.modify_user(uuid, add_usage_gb=add_gb, add_days=add_days):
+            account_service.invalidate(uuid)
             new_info = api_handler.user_info(uuid)
             daily_usage = db.get_usage_since_midnight_by_uuid(uuid)
             text = fmt_one(new_info, daily_usage) + "\n\n✅ *کاربر با موفقیت ویرایش شد\\.*"
@@ -303,6 +305,13 @@ def _handle_health_check(call: types.CallbackQuery):
         logger.error(f"ADMIN HEALTH CHECK Error for chat {call.from_user.id}: {e}")
         _safe_edit(call.from_user.id, call.message.message_id, "❌ خطایی در دریافت اطلاعات سلامت پنل رخ داد\\.", reply_markup=menu.admin_analytics_menu())
 
+def _handle_api_stats(call: types.CallbackQuery):
+    text = fmt_api_stats(api_handler.api_stats()) + "\n\n" + fmt_db_stats(db.maintenance_stats())
+    kb = types.InlineKeyboardMarkup()
+    kb.add(types.InlineKeyboardButton("🔄 به‌روزرسانی", callback_data="admin_api_stats"))
+    kb.add(types.InlineKeyboardButton("🔙 بازگشت به تحلیل‌ها", callback_data="admin_analytics"))
+    _safe_edit(call.from_user.id, call.message.message_id, text, reply_markup=kb)
+
 def _handle_backup_request(call: types.CallbackQuery):
     chat_id = call.from_user.id
     log_adapter = logging.LoggerAdapter(logger, {'user_id': chat_id})
@@ -314,31 +323,33 @@ def _handle_backup_request(call: types.CallbackQuery):
         bot.send_message(chat_id, "❌ فایل دیتابیس یافت نشد\\.")
         return
 
+    result = None
     try:
-        file_size = os.path.getsize(DATABASE_PATH)
-        
-        if file_size > TELEGRAM_FILE_SIZE_LIMIT_BYTES:
-            size_in_mb = file_size / (1024 * 1024)
-            error_message = (
-                f"❌ خطا: حجم فایل دیتابیس ({size_in_mb:.2f} MB) "
-                f"بیشتر از حد مجاز تلگرام (50 MB) است.\n\n"
-                "امکان ارسال آن از طریق ربات وجود ندارد. لطفاً فایل را به صورت دستی از سرور کپی کنید."
-            )
-            bot.send_message(chat_id, error_message)
-            return
-
         bot.send_message(chat_id, "⏳ در حال آماده‌سازی و ارسال فایل پشتیبان \\.\\.\\.")
-        
-        with open(DATABASE_PATH, "rb") as db_file:
-            bot.send_document(chat_id, db_file, caption="✅ فایل پشتیبان دیتابیس\\.")
-            
+        # نسخه سازگار از دیتابیس زنده گرفته، فشرده و در صورت نیاز به چند بخش زیر سقف تلگرام تقسیم می‌شود
+        result = create_backup()
+
+        total = len(result.part_paths)
+        for index, path in enumerate(result.part_paths, start=1):
+            with open(path, "rb") as part_file:
+                bot.send_document(chat_id, part_file, caption=escape_markdown(f"📦 بخش {index} از {total}"))
+        with open(result.manifest_path, "rb") as manifest_file:
+            caption = (f"✅ فایل پشتیبان دیتابیس ({result.db_size / 1048576:.1f} MB → "
+                       f"{result.compressed_size / 1048576:.1f} MB، {total} بخش).\n"
+                       "برای بازیابی: python backup.py restore <manifest.json>")
+            bot.send_document(chat_id, manifest_file, caption=escape_markdown(caption))
+
     except ApiTelegramException as e:
         logger.error(f"Backup failed due to Telegram API error: {e}")
-        bot.send_message(chat_id, f"❌ خطای API تلگرام: {e.description}")
-        
+        bot.send_message(chat_id, escape_markdown(f"❌ خطای API تلگرام: {e.description}"))
+
     except Exception as e:
         logger.error(f"Backup failed with a general error: {e}")
-        bot.send_message(chat_id, f"❌ یک خطای ناشناخته رخ داد: {e}")
+        bot.send_message(chat_id, escape_markdown(f"❌ یک خطای ناشناخته رخ داد: {e}"))
+
+    finally:
+        if result is not None:
+            remove_backup(result)
 
 # --- دیکشنری مپ‌کننده Callback به توابع ---
 # این دیکشنری، callback_data های ثابت را به تابع مربوطه‌شان متصل می‌کند.
@@ -351,6 +362,7 @@ STATIC_CALLBACK_MAP = {
     "admin_search_user": _handle_search_user,
     "admin_broadcast": _handle_broadcast,
     "admin_health_check": _handle_health_check,
+    "admin_api_stats": _handle_api_stats,
     "admin_backup": _handle_backup_request,
 
 }
@@ -370,16 +382,19 @@ def handle_admin_callbacks(call: types.CallbackQuery):
         try:
             parts = data.split('_')
             base_callback = '_'.join(parts[:-1])
-            page = int(parts[-1])
+            page_str, _, cursor = parts[-1].partition(':')
+            page = int(page_str)
             bot.answer_callback_query(call.id, "در حال دریافت لیست")
             
             user_list, text, kb = [], "", None
+            total_items, prev_cursor, next_cursor = None, None, None
 
             if base_callback == "admin_online":
                 user_list = api_handler.online_users()
                 if user_list is None:
                     _safe_edit(uid, msg_id, "❌ امکان اتصال به پنل وجود ندارد. لطفاً بعداً دوباره تلاش کنید\\.", reply_markup=menu.admin_reports_menu())
-                for user in user_list: user['daily_usage_GB'] = db.get_usage_since_midnight_by_uuid(user['uuid'])
+                daily_usage_map = db.get_daily_usage_map(user['uuid'] for user in user_list)
+                for user in user_list: user['daily_usage_GB'] = daily_usage_map.get(user['uuid'], 0.0)
                 text = fmt_online_users_list(user_list, page)
 
             elif base_callback == "admin_active_1":
@@ -402,11 +417,11 @@ def handle_admin_callbacks(call: types.CallbackQuery):
                     user['created_at'] = uuid_to_created_at.get(user['uuid'])
                 text = fmt_users_list(user_list, 'never_connected', page)
             elif base_callback == "admin_birthdays":
-                user_list = db.get_users_with_birthdays()
-                text = fmt_birthdays_list(user_list, page)
+                user_list, total_items, prev_cursor, next_cursor = db.get_users_with_birthdays_page(page, cursor)
+                text = fmt_birthdays_list(user_list, page, total_items)
             elif base_callback == "admin_list_bot_users":
-                user_list = db.get_all_bot_users()
-                text = fmt_bot_users_list(user_list, page)
+                user_list, total_items, prev_cursor, next_cursor = db.get_bot_users_page(page, cursor)
+                text = fmt_bot_users_list(user_list, page, total_items)
             elif base_callback == "admin_top_consumers":
                 user_list = api_handler.get_top_consumers()
                 text = fmt_top_consumers(user_list, page)
@@ -418,7 +433,9 @@ def handle_admin_callbacks(call: types.CallbackQuery):
                 "admin_top_consumers": "admin_analytics"
             }
             back_callback = back_callback_map.get(base_callback, "admin_panel")
-            kb = menu.create_pagination_menu(base_callback, page, len(user_list), back_callback)
+            if total_items is None:
+                total_items = len(user_list)
+            kb = menu.create_pagination_menu(base_callback, page, total_items, back_callback, prev_cursor, next_cursor)
             
             if kb: _safe_edit(uid, msg_id, text, reply_markup=kb)
 
@@ -431,6 +448,7 @@ def handle_admin_callbacks(call: types.CallbackQuery):
         uuid = data.replace("admin_toggle_", "")
         info = api_handler.user_info(uuid)
         if info and api_handler.modify_user(uuid, data={'is_active': not info['is_active']}):
+            account_service.invalidate(uuid)
             bot.answer_callback_query(call.id, f"کاربر {'فعال' if not info['is_active'] else 'غیرفعال'} شد.")
             new_info = api_handler.user_info(uuid)
             daily_usage = db.get_usage_since_midnight_by_uuid(uuid)
@@ -449,6 +467,7 @@ def handle_admin_callbacks(call: types.CallbackQuery):
     elif data.startswith("admin_reset_usage_"):
         uuid = data.replace("admin_reset_usage_", "")
         if api_handler.reset_user_usage(uuid):
+            account_service.invalidate(uuid)
             bot.answer_callback_query(call.id, "✅ مصرف کاربر صفر شد.")
             new_info = api_handler.user_info(uuid)
             daily_usage = db.get_usage_since_midnight_by_uuid(uuid)
@@ -463,6 +482,7 @@ def handle_admin_callbacks(call: types.CallbackQuery):
         uuid = data.replace("admin_confirm_delete_", "")
         _safe_edit(uid, msg_id, "⏳ در حال حذف کامل کاربر...")
         if api_handler.delete_user(uuid):
+            account_service.invalidate(uuid)
             db.delete_user_by_uuid(uuid)
             _safe_edit(uid, msg_id, "✅ کاربر با موفقیت از پنل و ربات حذف شد\\.", reply_markup=menu.admin_management_menu())
         else: _safe_edit(uid, msg_id, "❌ خطا در حذف کاربر از پنل\\.", reply_markup=menu.admin_management_menu())
@@ -1,34 +1,40 @@
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
 from datetime import datetime, timedelta
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Callable, Iterable, NamedTuple, Optional, List, Tuple
 import pytz
 import requests
+from cachetools import TTLCache
 from requests.adapters import HTTPAdapter, Retry
-from cachetools import cached
 
-from config import HIDDIFY_DOMAIN, ADMIN_PROXY_PATH, ADMIN_UUID, API_TIMEOUT, api_cache
+from config import (HIDDIFY_DOMAIN, ADMIN_PROXY_PATH, ADMIN_UUID, API_TIMEOUT, API_RETRY_COUNT,
+                    API_STREAM_USER_LIST, API_STREAM_CHUNK_SIZE, API_POOL_SIZE, API_BULK_WORKERS, API_BULK_RETRIES,
+                    HIDDIFY_PANELS, FEDERATION_LOOKUP_TIMEOUT, USER_INFO_CACHE_TTL, USER_INFO_CACHE_SIZE,
+                    USER_DIRECTORY_SNAPSHOT_PATH)
+from api_metrics import ApiMetrics, CircuitBreaker, BREAKER_FAILURES, endpoint_key
 from utils import safe_float
+from panel_user import PanelUser
+from user_directory import UserDirectory
+from user_changes import diff_snapshots
+from json_stream import iter_json_items
 
 logger = logging.getLogger(__name__)
 
-class HiddifyAPIHandler:
-    def __init__(self):
-        self.base_url = f"{HIDDIFY_DOMAIN.rstrip('/')}/{ADMIN_PROXY_PATH.strip('/')}/api/v2/admin"
-        self.api_key = ADMIN_UUID
-        self.tehran_tz = pytz.timezone("Asia/Tehran")
-        self.session = self._create_session()
+class HiddifyAPIBase:
+    """
+    Transport-independent parts of the Hiddify client: URLs, normalization and payload building,
+    usable without a session (e.g. by bench_normalize.py).
+    """
+    tehran_tz = pytz.timezone("Asia/Tehran")
 
-    def _create_session(self) -> requests.Session:
-        session = requests.Session()
-        session.headers.update({
-            "Hiddify-API-Key": self.api_key,
-            "Accept": "application/json"
-        })
-        retries = Retry(total=3, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504])
-        adapter = HTTPAdapter(max_retries=retries)
-        session.mount('http://', adapter)
-        session.mount('https://', adapter)
-        return session
+    def __init__(self, domain: str = HIDDIFY_DOMAIN, proxy_path: str = ADMIN_PROXY_PATH, api_key: Optional[str] = ADMIN_UUID,
+                 name: str = "main"):
+        self.name = name
+        self.base_url = f"{domain.rstrip('/')}/{proxy_path.strip('/')}/api/v2/admin"
+        self.panel_info_url = f"{domain.rstrip('/')}/{proxy_path.strip('/')}/api/v2/panel/info/"
+        self.api_key = api_key
 
     def _parse_api_datetime(self, date_str: Optional[str]) -> Optional[datetime]:
         if not date_str or date_str.startswith('0001-01-01'):
@@ -63,118 +69,349 @@ class HiddifyAPIHandler:
         expiration_date = start_date + timedelta(days=package_days)
         return (expiration_date - datetime.now(self.tehran_tz).date()).days
 
-    def _norm(self, raw: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    def _norm(self, raw: Dict[str, Any], batch: Optional["_NormBatch"] = None) -> Optional[PanelUser]:
         if not isinstance(raw, dict): return None
+        if batch is None:
+            batch = _NormBatch(self)
         try:
-            usage_limit = safe_float(raw.get("usage_limit_GB", 0))
-            current_usage = safe_float(raw.get("current_usage_GB", 0))
-            return {
-                "name": raw.get("name") or "کاربر ناشناس",
-                "uuid": raw.get("uuid", "").lower(),
-                "is_active": bool(raw.get("is_active", raw.get("enable", False))),
-                "last_online": self._parse_api_datetime(raw.get("last_online")),
-                "usage_limit_GB": usage_limit,
-                "current_usage_GB": current_usage,
-                "remaining_GB": max(0, usage_limit - current_usage),
-                "usage_percentage": (current_usage / usage_limit * 100) if usage_limit > 0 else 0,
-                "expire": self._calculate_remaining_days(raw.get("start_date"), raw.get("package_days")),
-                "mode": raw.get("mode", "no_reset")
-            }
+            return PanelUser(
+                name=raw.get("name") or "کاربر ناشناس",
+                uuid=raw.get("uuid", "").lower(),
+                is_active=bool(raw.get("is_active", raw.get("enable", False))),
+                last_online_ts=batch.parse_last_online(raw.get("last_online")),
+                usage_limit_GB=safe_float(raw.get("usage_limit_GB", 0)),
+                current_usage_GB=safe_float(raw.get("current_usage_GB", 0)),
+                expire=batch.remaining_days(raw.get("start_date"), raw.get("package_days")),
+                mode=raw.get("mode", "no_reset"),
+                panel=self.name,
+            )
         except Exception as e:
             logger.error(f"Data normalization failed: {e}, raw data: {raw}")
             return None
 
+    def normalize_users(self, raw_users: Iterable[Dict[str, Any]]) -> List[PanelUser]:
+        """Normalizes a whole /user/ payload sharing one clock read and one date-parsing memo."""
+        batch = _NormBatch(self)
+        return [norm_user for u in raw_users if (norm_user := self._norm(u, batch))]
+
+    def _extract_raw_users(self, data: Any) -> List[Dict[str, Any]]:
+        if isinstance(data, list):
+            return data
+        if isinstance(data, dict):
+            return data.get("results") or data.get("users") or []
+        return []
+
+    def _build_modify_payload(self, current_info: Dict[str, Any], add_usage_gb: float = 0, add_days: int = 0) -> Dict[str, Any]:
+        payload = {}
+
+        # محاسبه و افزودن حجم جدید
+        if add_usage_gb:
+            current_limit_gb = current_info.get("usage_limit_GB", 0)
+            payload["usage_limit_GB"] = current_limit_gb + add_usage_gb
+
+        # محاسبه و افزودن روزهای جدید
+        if add_days:
+            current_expire_days = current_info.get("expire") or 0
+            # اگر اکانت منقضی شده باشد، از امروز محاسبه کن
+            if current_expire_days < 0:
+                current_expire_days = 0
+            payload["package_days"] = current_expire_days + add_days
+        return payload
+
+
+class _NormBatch:
+    """
+    Per-batch state used while normalizing many users at once.
+    "now" and "today in Tehran" are read once, timestamps go through datetime.fromisoformat,
+    the Tehran UTC offset is computed once per distinct hour, and start_date strings
+    (which repeat a lot) are parsed once each. Anything the fast path can't handle falls
+    back to the original per-value parsers so behaviour stays identical.
+    """
+    __slots__ = ("api", "today_ordinal", "_offsets", "_start_dates")
+
+    def __init__(self, api: HiddifyAPIBase):
+        self.api = api
+        self.today_ordinal = datetime.now(api.tehran_tz).date().toordinal()
+        self._offsets: Dict[str, float] = {}
+        self._start_dates: Dict[str, Optional[int]] = {}
+
+    def parse_last_online(self, date_str: Optional[str]) -> Optional[float]:
+        if not date_str or date_str.startswith('0001-01-01'):
+            return None
+        naive_dt = None
+        try:
+            clean_str = date_str.split('.')[0]
+            if len(clean_str) == 19:
+                naive_dt = datetime.fromisoformat(clean_str)
+        except (ValueError, TypeError, AttributeError):
+            pass
+        if naive_dt is None or naive_dt.tzinfo is not None:
+            parsed = self.api._parse_api_datetime(date_str)
+            return parsed.timestamp() if parsed else None
+
+        hour_key = date_str[:13]
+        offset = self._offsets.get(hour_key)
+        if offset is None:
+            offset = self.api.tehran_tz.localize(naive_dt).utcoffset().total_seconds()
+            self._offsets[hour_key] = offset
+        return (naive_dt - _EPOCH).total_seconds() - offset
+
+    def remaining_days(self, start_date_str: Optional[str], package_days: Optional[int]) -> Optional[int]:
+        if package_days in [None, 0]:
+            return None
+        start_ordinal = self.today_ordinal
+        if start_date_str:
+            if start_date_str in self._start_dates:
+                parsed = self._start_dates[start_date_str]
+            else:
+                parsed = self._parse_start_date(start_date_str)
+                self._start_dates[start_date_str] = parsed
+            if parsed is not None:
+                start_ordinal = parsed
+        return start_ordinal + package_days - self.today_ordinal
+
+    @staticmethod
+    def _parse_start_date(start_date_str: str) -> Optional[int]:
+        try:
+            return datetime.strptime(start_date_str.split('T')[0], "%Y-%m-%d").toordinal()
+        except (ValueError, TypeError):
+            logger.warning(f"Could not parse start_date string '{start_date_str}', using today's date.")
+            return None
+
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+class UserDirectoryQueries:
+    """Read-only user queries answered from `self.directory`, shared by the single and federated handlers."""
+    directory: UserDirectory
+
+    def get_all_users(self) -> List[Dict[str, Any]]:
+        # لیست از دایرکتوری مشترک خوانده می‌شود و فقط یک دانلود همزمان در جریان است
+        return self.directory.users()
+
+    def find_user(self, query: str) -> Optional[Dict[str, Any]]:
+        """Finds a user by exact UUID or by a part of the name."""
+        return self.directory.store().search(query)
+
+    def get_top_consumers(self) -> List[Dict[str, Any]]:
+        """Returns all users sorted by current usage in descending order."""
+        return list(self.directory.store().by_usage)
+
+    def online_users(self) -> List[Dict[str, Any]]:
+        three_minutes_ago = datetime.now(pytz.utc) - timedelta(minutes=3)
+        return [u for u in self.directory.store().seen_since(three_minutes_ago.timestamp()) if u.get('is_active')]
+
+    def get_active_users(self, days: int) -> List[Dict[str, Any]]:
+        deadline = datetime.now(pytz.utc) - timedelta(days=days)
+        return self.directory.store().seen_since(deadline.timestamp())
+
+    def get_inactive_users(self, min_days: int, max_days: int) -> List[Dict[str, Any]]:
+        """
+        Users last seen between `min_days` (inclusive) and `max_days` (exclusive) whole days ago.
+        min_days == -1 additionally includes users who have never connected.
+        """
+        store = self.directory.store()
+        inactive = list(store.never_online) if min_days == -1 else []
+        if max_days > min_days:
+            now_ts = datetime.now(pytz.utc).timestamp()
+            inactive.extend(store.seen_between(now_ts - max_days * 86400, now_ts - min_days * 86400))
+        return inactive
+
+
+class ModifyResult(NamedTuple):
+    """Outcome of one item of bulk_modify_users."""
+    uuid: str
+    ok: bool
+    attempts: int
+    error: Optional[str] = None
+
+
+def _classify_request_error(error: Exception) -> str:
+    """Maps a requests exception to the error kind recorded in ApiMetrics."""
+    if isinstance(error, requests.exceptions.Timeout):
+        return "timeout"
+    if isinstance(error, requests.exceptions.RetryError):
+        return "http_5xx"  # urllib3 gave up after retrying 5xx responses
+    if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+        return "http_5xx" if error.response.status_code >= 500 else "http_4xx"
+    if isinstance(error, requests.exceptions.ConnectionError):
+        return "connection"
+    if isinstance(error, ValueError):
+        return "invalid_response"
+    return "other"
+
+
+def _fresh_snapshot(directory: UserDirectory) -> Tuple[Any, Optional[float]]:
+    """
+    The directory snapshot to compute absolute PATCH values from, refreshed first if it is past
+    its TTL. Returns (None, None) if it is still a disk-restored or stale snapshot, since its
+    limits may predate changes made on the panel since.
+    """
+    directory.ensure_fresh()
+    if directory.restored or directory.is_stale():
+        logger.warning(f"UserDirectory[{directory.name}] is not fresh, bulk modify will read each user from the panel")
+        return None, None
+    return directory.snapshot()
+
+
+class HiddifyAPIHandler(HiddifyAPIBase, UserDirectoryQueries):
+    def __init__(self, *args, breaker: Optional[CircuitBreaker] = None, metrics: Optional[ApiMetrics] = None,
+                 persist: bool = True, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.session = self._create_session()
+        self.breaker = breaker or CircuitBreaker()
+        self.metrics = metrics or ApiMetrics()
+        self.directory = UserDirectory(self._fetch_all_users, diff=diff_snapshots,
+                                       snapshot_path=USER_DIRECTORY_SNAPSHOT_PATH.format(name="hiddify") if persist else None)
+        # uuid -> (PanelUser or None if deleted, time the panel state was read)
+        self._info_cache: TTLCache = TTLCache(maxsize=USER_INFO_CACHE_SIZE, ttl=USER_INFO_CACHE_TTL)
+        self._info_lock = threading.Lock()
+
+    def _create_session(self) -> requests.Session:
+        session = requests.Session()
+        session.headers.update({
+            "Hiddify-API-Key": self.api_key,
+            "Accept": "application/json"
+        })
+        retries = Retry(total=API_RETRY_COUNT, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504])
+        # کانکشن‌پول به اندازه‌ای که ویرایش‌های گروهی همزمان منتظر اتصال نمانند
+        adapter = HTTPAdapter(max_retries=retries, pool_connections=API_POOL_SIZE, pool_maxsize=API_POOL_SIZE)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def _guarded(self, method: str, url: str, key: str, send: Callable[[], Any]) -> Optional[Any]:
+        """
+        Runs one panel call through the circuit breaker and records its latency.
+        Timeouts, connection errors and 5xx responses count as breaker failures; a 4xx or a
+        malformed body means the panel answered, so it closes the circuit like a success.
+        """
+        if not self.breaker.allow():
+            self.metrics.count_error(key, "circuit_open")
+            logger.warning(f"API circuit is open, skipping {method} {url}")
+            return None
+        started = time.monotonic()
+        try:
+            result = send()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            kind = _classify_request_error(e)
+            self.metrics.observe(key, time.monotonic() - started, kind)
+            if kind in BREAKER_FAILURES:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            logger.error(f"API request failed ({kind}): {method} {url} - {e}")
+            return None
+        except Exception:
+            # Every call admitted by allow() must end in a success or failure, otherwise a
+            # half-open probe would stay in flight and keep the circuit shut for good.
+            self.metrics.observe(key, time.monotonic() - started, "other")
+            self.breaker.record_failure()
+            raise
+        self.metrics.observe(key, time.monotonic() - started)
+        self.breaker.record_success()
+        return result
+
     def _request(self, method: str, endpoint: str, **kwargs) -> Optional[Any]:
         url = f"{self.base_url}{endpoint}"
-        try:
+
+        def send():
             response = self.session.request(method, url, timeout=API_TIMEOUT, **kwargs)
             response.raise_for_status()
             return response.json() if response.status_code != 204 else True
-        except requests.exceptions.RequestException as e:
-            logger.error(f"API request failed: {method} {url} - {e}")
-            return None
+
+        return self._guarded(method, url, endpoint_key(method, endpoint), send)
+
+    def api_stats(self) -> Dict[str, Any]:
+        """Circuit breaker state and per-endpoint latency/error counters for the admin panel."""
+        return {"breaker": self.breaker.snapshot(), "endpoints": self.metrics.snapshot()}
 
     def test_connection(self) -> bool:
         return self._request("GET", "/user/") is not None
 
-    @cached(api_cache)
-    def get_all_users(self) -> List[Dict[str, Any]]:
-        # این تابع حالا فقط هر ۶۰ ثانیه یک بار واقعاً اجرا می‌شود
+    def _fetch_all_users(self) -> Optional[List[PanelUser]]:
+        """Downloads the full user list; returns None (not []) when the panel could not be reached."""
+        if API_STREAM_USER_LIST:
+            return self._stream_all_users()
         data = self._request("GET", "/user/")
-        if not data:
-            return []
-        
-        if isinstance(data, list):
-            raw_users = data
-        elif isinstance(data, dict):
-            raw_users = data.get("results") or data.get("users") or []
-        else:
-            return []
+        if data is None:
+            return None
+        return self.normalize_users(self._extract_raw_users(data))
+
+    def _stream_all_users(self) -> Optional[List[PanelUser]]:
+        """
+        Reads /user/ incrementally and normalizes each user as soon as it is decoded,
+        so the raw body and the list of raw dicts are never held in memory at once.
+        """
+        url = f"{self.base_url}/user/"
+
+        def send():
+            with self.session.get(url, timeout=API_TIMEOUT, stream=True) as response:
+                response.raise_for_status()
+                return self.normalize_users(iter_json_items(response.iter_content(API_STREAM_CHUNK_SIZE)))
 
-        return [norm_user for u in raw_users if (norm_user := self._norm(u))]
+        return self._guarded("GET", url, endpoint_key("GET", "/user/"), send)
 
     def user_info(self, uuid: str) -> Optional[Dict[str, Any]]:
+        """
+        Answers from, in order: the per-UUID cache (if newer than the directory snapshot),
+        the directory snapshot (if younger than USER_INFO_CACHE_TTL), then a GET to the panel.
+        Writes made through this handler update the cache, so they are never hidden by an
+        older snapshot.
+        """
+        uuid = uuid.lower()
+        store, fetched_at = self.directory.peek()
+        found, info = self._cached_info(uuid, fetched_at)
+        if found:
+            return info
+        if fetched_at is not None and time.time() - fetched_at < USER_INFO_CACHE_TTL:
+            info = store.get(uuid)
+            if info is not None:
+                return info
+        return self._fetch_user_info(uuid)
+
+    def _cached_info(self, uuid: str, snapshot_at: Optional[float]) -> Tuple[bool, Optional[PanelUser]]:
+        with self._info_lock:
+            entry = self._info_cache.get(uuid)
+        if entry is None or (snapshot_at is not None and entry[1] < snapshot_at):
+            return False, None
+        return True, entry[0]
+
+    def _cache_info(self, uuid: str, info: Optional[PanelUser], read_at: float) -> None:
+        with self._info_lock:
+            self._info_cache[uuid.lower()] = (info, read_at)
+
+    def _fetch_user_info(self, uuid: str) -> Optional[PanelUser]:
+        read_at = time.time()
         raw_data = self._request("GET", f"/user/{uuid}/")
-        return self._norm(raw_data) if raw_data else None
+        info = self._norm(raw_data) if raw_data else None
+        if info is not None:
+            self._cache_info(uuid, info, read_at)
+        return info
+
+    def _patch_user(self, uuid: str, payload: Dict[str, Any]) -> bool:
+        """PATCHes a user and refreshes the cache from the response body (one GET only if it has none)."""
+        read_at = time.time()
+        response = self._request("PATCH", f"/user/{uuid}/", json=payload)
+        if response is None:
+            return False
+        info = self._norm(response) if isinstance(response, dict) and response.get("uuid") else None
+        if info is not None:
+            self._cache_info(uuid, info, read_at)
+        else:
+            with self._info_lock:
+                self._info_cache.pop(uuid.lower(), None)
+            self._fetch_user_info(uuid)
+        return True
 
     def get_panel_info(self) -> Optional[Dict[str, Any]]:
-        panel_info_url = f"{HIDDIFY_DOMAIN.rstrip('/')}/{ADMIN_PROXY_PATH.strip('/')}/api/v2/panel/info/"
-        try:
-            response = self.session.get(panel_info_url, timeout=API_TIMEOUT)
+        def send():
+            response = self.session.get(self.panel_info_url, timeout=API_TIMEOUT)
             response.raise_for_status()
             return response.json()
-        except requests.exceptions.RequestException as e:
-            logger.error(f"API request for panel info failed: {e}")
-            return None
-        
-    def get_top_consumers(self) -> List[Dict[str, Any]]:
-        """
-        Fetches all users and sorts them by current usage in descending order.
-        """
-        all_users = self.get_all_users()
-        if not all_users:
-            return []
-        
-        # Sort users by the 'current_usage_GB' key
-        sorted_users = sorted(
-            all_users, 
-            key=lambda u: u.get('current_usage_GB', 0), 
-            reverse=True
-        )
-        return sorted_users
 
-    def online_users(self) -> List[Dict[str, Any]]:
-        all_users = self.get_all_users()
-        online = []
-        three_minutes_ago = datetime.now(pytz.utc) - timedelta(minutes=3)
-        for user in all_users:
-            if user.get('is_active') and user.get('last_online') and user['last_online'].astimezone(pytz.utc) >= three_minutes_ago:
-                online.append(user)
-        return online
-
-    def get_active_users(self, days: int) -> List[Dict[str, Any]]:
-        all_users = self.get_all_users()
-        active = []
-        deadline = datetime.now(pytz.utc) - timedelta(days=days)
-        for user in all_users:
-            if user.get('last_online') and user['last_online'].astimezone(pytz.utc) >= deadline:
-                active.append(user)
-        return active
-
-    def get_inactive_users(self, min_days: int, max_days: int) -> List[Dict[str, Any]]:
-        all_users = self.get_all_users()
-        inactive = []
-        now_utc = datetime.now(pytz.utc)
-        for user in all_users:
-            last_online = user.get('last_online')
-            if min_days == -1 and last_online is None:
-                inactive.append(user)
-                continue
-            if last_online:
-                days_since_online = (now_utc - last_online.astimezone(pytz.utc)).days
-                if min_days <= days_since_online < max_days:
-                    inactive.append(user)
-        return inactive
+        return self._guarded("GET", self.panel_info_url, endpoint_key("GET", "/panel/info/"), send)
 
     def add_user(self, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         new_user_raw = self._request("POST", "/user/", json=data)
@@ -190,7 +427,7 @@ class HiddifyAPIHandler:
         """
         # اگر داده خام ارسال شده باشد (برای موارد قدیمی مانند ریست مصرف)
         if data:
-            return self._request("PATCH", f"/user/{uuid}/", json=data) is not None
+            return self._patch_user(uuid, data)
 
         payload = {}
         
@@ -200,30 +437,246 @@ class HiddifyAPIHandler:
             if not current_info:
                 logger.error(f"Cannot modify user {uuid}: Could not fetch current info.")
                 return False
-
-            # محاسبه و افزودن حجم جدید
-            if add_usage_gb:
-                current_limit_gb = current_info.get("usage_limit_GB", 0)
-                payload["usage_limit_GB"] = current_limit_gb + add_usage_gb
-
-            # محاسبه و افزودن روزهای جدید
-            if add_days:
-                current_expire_days = current_info.get("expire", 0)
-                # اگر اکانت منقضی شده باشد، از امروز محاسبه کن
-                if current_expire_days < 0:
-                    current_expire_days = 0
-                payload["package_days"] = current_expire_days + add_days
+            payload = self._build_modify_payload(current_info, add_usage_gb, add_days)
         
         if not payload:
             return True # کاری برای انجام دادن نیست
         
         # ارسال درخواست به API
-        return self._request("PATCH", f"/user/{uuid}/", json=payload) is not None
+        return self._patch_user(uuid, payload)
+
+    def bulk_modify_users(self, changes: Iterable[Tuple[str, Dict[str, Any]]], max_workers: int = API_BULK_WORKERS,
+                          retries: int = API_BULK_RETRIES,
+                          snapshot: Optional[Tuple[Any, Optional[float]]] = None) -> Dict[str, ModifyResult]:
+        """
+        Applies many modifications concurrently. Each change is `(uuid, delta)` where delta holds
+        `add_usage_gb`/`add_days` and/or a raw `data` payload, like modify_user's arguments.
+
+        Current limits come from the directory snapshot (with `expire` shifted to today if the
+        snapshot is from an earlier day), so each user costs one PATCH instead of GET + PATCH;
+        users missing from the snapshot fall back to user_info. The PATCH carries absolute
+        values, so retrying a failed item is safe. Returns one ModifyResult per uuid.
+        `snapshot` lets a caller that owns the directory (the federated handler) supply it;
+        `(None, None)` means no snapshot can be trusted and every item uses user_info.
+        """
+        changes = list(changes)
+        if not changes:
+            return {}
+        owns_snapshot = snapshot is None
+        store, fetched_at = _fresh_snapshot(self.directory) if owns_snapshot else snapshot
+        day_shift = 0
+        if fetched_at is not None:
+            snapshot_day = datetime.fromtimestamp(fetched_at, self.tehran_tz).toordinal()
+            day_shift = datetime.now(self.tehran_tz).toordinal() - snapshot_day
+
+        def apply(change: Tuple[str, Dict[str, Any]]) -> ModifyResult:
+            uuid, delta = change
+            payload = dict(delta.get("data") or {})
+            add_usage_gb, add_days = delta.get("add_usage_gb", 0), delta.get("add_days", 0)
+            if add_usage_gb or add_days:
+                found, current = self._cached_info(uuid.lower(), fetched_at)
+                if not found:
+                    current = store.get(uuid) if store is not None else None
+                    day_shift_for_item = day_shift
+                else:
+                    day_shift_for_item = 0  # cache entries are at most USER_INFO_CACHE_TTL old
+                if current is not None:
+                    expire = current.expire
+                    current_info = {"usage_limit_GB": current.usage_limit_GB,
+                                    "expire": None if expire is None else expire - day_shift_for_item}
+                else:
+                    current_info = self.user_info(uuid)
+                    if not current_info:
+                        return ModifyResult(uuid, False, 1, "could not fetch current info")
+                payload.update(self._build_modify_payload(current_info, add_usage_gb, add_days))
+            if not payload:
+                return ModifyResult(uuid, True, 0)
+
+            for attempt in range(1, retries + 2):
+                if self._patch_user(uuid, payload):
+                    return ModifyResult(uuid, True, attempt)
+                if attempt <= retries:
+                    time.sleep(0.5 * (2 ** (attempt - 1)))
+            return ModifyResult(uuid, False, retries + 1, "PATCH failed")
+
+        def apply_safely(change: Tuple[str, Dict[str, Any]]) -> ModifyResult:
+            try:
+                return apply(change)
+            except Exception as e:
+                logger.error(f"Bulk modify failed for user {change[0]}: {e}")
+                return ModifyResult(change[0], False, 0, str(e))
+
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(changes))),
+                                thread_name_prefix="hiddify-bulk-modify") as pool:
+            results = {result.uuid: result for result in pool.map(apply_safely, changes)}
+
+        failed = [r for r in results.values() if not r.ok]
+        logger.info(f"Bulk modify finished: {len(results) - len(failed)} succeeded, {len(failed)} failed.")
+        if owns_snapshot and len(failed) < len(results):
+            self.directory.refresh(wait=False)  # the snapshot no longer reflects the new limits
+        return results
+
+    def delete_user(self, uuid: str) -> bool:
+        deleted = self._request("DELETE", f"/user/{uuid}/") is True
+        if deleted:
+            # تا لیست کامل بعدی، کاربر حذف‌شده از روی نسخه قدیمی لیست برگردانده نشود
+            self._cache_info(uuid, None, time.time())
+        return deleted
+
+    def reset_user_usage(self, uuid: str) -> bool:
+        return self.modify_user(uuid, {"current_usage_GB": 0})
+
+class FederatedHiddifyAPIHandler(UserDirectoryQueries):
+    """
+    Presents several Hiddify panels as one. `/user/` is fetched from every panel in parallel
+    (a refresh takes as long as the slowest panel, not the sum) and merged into a single
+    directory keyed by UUID, each user tagged with its `panel`. Calls for one user are routed
+    to the panel that owns the UUID. A panel that fails a refresh keeps contributing its users
+    from the previous successful fetch, so one outage doesn't empty the merged list.
+    """
+
+    def __init__(self, panels: List[HiddifyAPIHandler]):
+        if not panels:
+            raise ValueError("At least one panel is required")
+        self.panels = panels
+        self.primary = panels[0]
+        self._by_name = {panel.name: panel for panel in panels}
+        self._last_users: Dict[str, List[PanelUser]] = {}
+        self._routes: Dict[str, HiddifyAPIHandler] = {}
+        self._executor = ThreadPoolExecutor(max_workers=max(len(panels), API_BULK_WORKERS),
+                                            thread_name_prefix="hiddify-federation")
+        self.directory = UserDirectory(self._fetch_all_users, name="hiddify-federated", diff=diff_snapshots,
+                                       snapshot_path=USER_DIRECTORY_SNAPSHOT_PATH.format(name="hiddify-federated"))
+        for panel in panels:
+            panel.directory = self.directory
+        for user in self.directory.peek()[0].users:  # a restored snapshot stands in for panels that are down
+            self._last_users.setdefault(user.panel, []).append(user)
+
+    def _fetch_all_users(self) -> Optional[List[PanelUser]]:
+        futures = {self._executor.submit(panel._fetch_all_users): panel for panel in self.panels}
+        any_fresh = False
+        for future in as_completed(futures):
+            panel = futures[future]
+            try:
+                users = future.result()
+            except Exception as e:
+                logger.error(f"Federation: fetching users from panel '{panel.name}' failed: {e}")
+                users = None
+            if users is None:
+                logger.warning(f"Federation: panel '{panel.name}' unavailable, reusing its last "
+                               f"{len(self._last_users.get(panel.name, []))} users")
+            else:
+                self._last_users[panel.name] = users
+                any_fresh = True
+        if not any_fresh:
+            return None
+
+        merged: Dict[str, PanelUser] = {}
+        for panel in self.panels:
+            for user in self._last_users.get(panel.name, []):
+                owner = merged.setdefault(user.uuid, user)
+                if owner is not user:
+                    logger.warning(f"Federation: UUID {user.uuid} exists on panels '{owner.panel}' and "
+                                   f"'{panel.name}'; using '{owner.panel}'")
+        return list(merged.values())
+
+    def _panel_for(self, uuid: str) -> Optional[HiddifyAPIHandler]:
+        """Owning panel of `uuid`: from the merged snapshot, else probing all panels in parallel."""
+        uuid = uuid.lower()
+        user = self.directory.store().get(uuid)
+        if user is not None and user.panel in self._by_name:
+            return self._by_name[user.panel]
+        if uuid in self._routes:
+            return self._routes[uuid]
+        return self._probe(uuid)[0]
+
+    def _probe(self, uuid: str) -> Tuple[Optional[HiddifyAPIHandler], Optional[Dict[str, Any]]]:
+        futures = {self._executor.submit(panel.user_info, uuid): panel for panel in self.panels}
+        found = (None, None)
+        try:
+            for future in as_completed(futures, timeout=FEDERATION_LOOKUP_TIMEOUT):
+                info = future.result()
+                if info:
+                    found = (futures[future], info)
+                    self._routes[uuid] = futures[future]
+                    break
+        except Exception as e:
+            logger.error(f"Federation: looking up {uuid} on all panels failed: {e}")
+        return found
+
+    def test_connection(self) -> bool:
+        return all(self._executor.map(lambda panel: panel.test_connection(), self.panels))
+
+    def user_info(self, uuid: str) -> Optional[Dict[str, Any]]:
+        uuid = uuid.lower()
+        user = self.directory.store().get(uuid)
+        if user is not None and user.panel in self._by_name:
+            return self._by_name[user.panel].user_info(uuid)
+        if uuid in self._routes:
+            return self._routes[uuid].user_info(uuid)
+        return self._probe(uuid)[1]
+
+    def get_panel_info(self, panel: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        return self._by_name.get(panel, self.primary).get_panel_info()
+
+    def add_user(self, data: Dict[str, Any], panel: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Creates the user on `panel` (by name), or on the first configured panel."""
+        target = self._by_name.get(panel, self.primary)
+        new_user = target.add_user(data)
+        if new_user:
+            self._routes[new_user['uuid']] = target
+        return new_user
+
+    def modify_user(self, uuid: str, data: dict = None, add_usage_gb: float = 0, add_days: int = 0) -> bool:
+        panel = self._panel_for(uuid)
+        if panel is None:
+            logger.error(f"Federation: no panel owns user {uuid}; modify skipped.")
+            return False
+        return panel.modify_user(uuid, data, add_usage_gb=add_usage_gb, add_days=add_days)
+
+    def bulk_modify_users(self, changes: Iterable[Tuple[str, Dict[str, Any]]], max_workers: int = API_BULK_WORKERS,
+                          retries: int = API_BULK_RETRIES) -> Dict[str, ModifyResult]:
+        """Splits the changes by owning panel and runs each panel's bulk modify concurrently."""
+        snapshot = _fresh_snapshot(self.directory)
+        groups: Dict[str, List[Tuple[str, Dict[str, Any]]]] = {}
+        results: Dict[str, ModifyResult] = {}
+        for uuid, delta in changes:
+            panel = self._panel_for(uuid)
+            if panel is None:
+                results[uuid] = ModifyResult(uuid, False, 0, "no panel owns this UUID")
+            else:
+                groups.setdefault(panel.name, []).append((uuid, delta))
+        futures = [self._executor.submit(self._by_name[name].bulk_modify_users, group, max_workers, retries, snapshot)
+                   for name, group in groups.items()]
+        wait(futures)
+        for future in futures:
+            results.update(future.result())
+        if any(r.ok for r in results.values()):
+            self.directory.refresh(wait=False)
+        return results
 
     def delete_user(self, uuid: str) -> bool:
-        return self._request("DELETE", f"/user/{uuid}/") is True
+        panel = self._panel_for(uuid)
+        if panel is None:
+            return False
+        deleted = panel.delete_user(uuid)
+        if deleted:
+            self._routes.pop(uuid.lower(), None)
+        return deleted
 
     def reset_user_usage(self, uuid: str) -> bool:
         return self.modify_user(uuid, {"current_usage_GB": 0})
 
-api_handler = HiddifyAPIHandler()
\ No newline at end of file
+    def api_stats(self) -> Dict[str, Any]:
+        return {"panels": {panel.name: panel.api_stats() for panel in self.panels}}
+
+
+def create_api_handler(panels: List[Dict[str, Any]] = HIDDIFY_PANELS):
+    """One plain handler for a single panel, a federated handler when several are configured."""
+    federated = len(panels) > 1
+    handlers = [HiddifyAPIHandler(p["domain"], p["proxy_path"], p["api_key"], name=p["name"], persist=not federated)
+                for p in panels]
+    return handlers[0] if len(handlers) == 1 else FederatedHiddifyAPIHandler(handlers)
+
+
+api_handler = create_api_handler()
\ No newline at end of file
@@ -0,0 +1,149 @@
+import re
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, Optional, Tuple
+
+from config import API_BREAKER_FAILURE_THRESHOLD, API_BREAKER_RESET_SECONDS
+
+_UUID_IN_PATH_RE = re.compile(r"[0-9a-fA-F]{8}-(?:[0-9a-fA-F]{4}-){3}[0-9a-fA-F]{12}")
+
+# Error kinds that mean "the panel is unhealthy" and count towards opening the circuit.
+BREAKER_FAILURES = frozenset(("timeout", "connection", "http_5xx"))
+
+LATENCY_BUCKETS: Tuple[float, ...] = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 15.0, 30.0, 60.0)
+
+
+def endpoint_key(method: str, path: str) -> str:
+    """Groups requests per endpoint, e.g. 'PATCH /user/{uuid}/'."""
+    return f"{method.upper()} {_UUID_IN_PATH_RE.sub('{uuid}', path)}"
+
+
+class CircuitBreaker:
+    """
+    Classic three-state breaker. After `failure_threshold` consecutive failures the circuit
+    opens and calls fail fast; after `reset_timeout` seconds a single probe is let through
+    (half-open) and its outcome closes or re-opens the circuit.
+    """
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold: int = API_BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout: float = API_BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self.times_opened = 0
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self._state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    self.times_opened += 1
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            retry_in = None
+            if self._state == self.OPEN:
+                retry_in = max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+            return {"state": self._state, "consecutive_failures": self._failures,
+                    "times_opened": self.times_opened, "rejected": self.rejected, "retry_in": retry_in}
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram (seconds) with count, sum and max."""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last slot is "> largest bucket"
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        index = next((i for i, bound in enumerate(self.buckets) if seconds <= bound), len(self.buckets))
+        self.counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        """Upper bound of the bucket containing the given percentile (None if no samples)."""
+        if not self.count:
+            return None
+        target = fraction * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= target:
+                return self.buckets[index] if index < len(self.buckets) else self.max
+        return self.max
+
+
+class ApiMetrics:
+    """Per-endpoint latency histograms and error counters, safe to update from any thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latency: Dict[str, LatencyHistogram] = {}
+        self._errors: Dict[str, Counter] = {}
+
+    def observe(self, endpoint: str, seconds: float, error: Optional[str] = None) -> None:
+        with self._lock:
+            histogram = self._latency.get(endpoint)
+            if histogram is None:
+                histogram = self._latency[endpoint] = LatencyHistogram()
+            histogram.observe(seconds)
+            if error:
+                self._errors.setdefault(endpoint, Counter())[error] += 1
+
+    def count_error(self, endpoint: str, error: str) -> None:
+        with self._lock:
+            self._errors.setdefault(endpoint, Counter())[error] += 1
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            result = {}
+            for endpoint in sorted(set(self._latency) | set(self._errors)):
+                histogram = self._latency.get(endpoint)
+                result[endpoint] = {
+                    "count": histogram.count if histogram else 0,
+                    "avg": (histogram.total / histogram.count) if histogram and histogram.count else None,
+                    "p50": histogram.percentile(0.5) if histogram else None,
+                    "p95": histogram.percentile(0.95) if histogram else None,
+                    "max": histogram.max if histogram else None,
+                    "buckets": dict(zip([*map(str, histogram.buckets), "inf"], histogram.counts)) if histogram else {},
+                    "errors": dict(self._errors.get(endpoint, {})),
+                }
+            return result
@@ -0,0 +1,231 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+import time
+from datetime import datetime
+from typing import BinaryIO, List, NamedTuple, Optional
+
+from config import (DATABASE_PATH, DB_BUSY_TIMEOUT, BACKUP_DIR, BACKUP_PART_SIZE_BYTES,
+                    BACKUP_COMPRESSION_LEVEL)
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FORMAT = 1
+_CHUNK = 1024 * 1024
+
+
+class BackupResult(NamedTuple):
+    manifest_path: str
+    part_paths: List[str]
+    db_size: int
+    compressed_size: int
+    seconds: float
+
+
+class _PartWriter:
+    """File-like sink that splits everything written to it into numbered parts of at most `part_size` bytes."""
+
+    def __init__(self, prefix: str, part_size: int):
+        self.prefix = prefix
+        self.part_size = part_size
+        self.parts: List[dict] = []
+        self.paths: List[str] = []
+        self._file: Optional[BinaryIO] = None
+        self._hash = None
+        self._written = 0
+
+    def write(self, data) -> int:
+        view = memoryview(data)
+        while view:
+            if self._file is None or self._written >= self.part_size:
+                self._next_part()
+            chunk = view[:self.part_size - self._written]
+            self._file.write(chunk)
+            self._hash.update(chunk)
+            self._written += len(chunk)
+            view = view[len(chunk):]
+        return len(data)
+
+    def flush(self) -> None:
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self) -> None:
+        self._finish_part()
+
+    def _next_part(self) -> None:
+        self._finish_part()
+        path = f"{self.prefix}.{len(self.paths) + 1:03d}"
+        self._file = open(path, "wb")
+        self._hash = hashlib.sha256()
+        self._written = 0
+        self.paths.append(path)
+
+    def _finish_part(self) -> None:
+        if self._file is None:
+            return
+        self._file.close()
+        self.parts.append({"name": os.path.basename(self.paths[-1]), "size": self._written,
+                           "sha256": self._hash.hexdigest()})
+        self._file = None
+
+
+def _sha256_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def create_backup(db_path: str = DATABASE_PATH, out_dir: str = BACKUP_DIR,
+                  part_size: int = BACKUP_PART_SIZE_BYTES) -> BackupResult:
+    """
+    Takes a consistent copy of the live database with the SQLite online backup API, gzips it
+    and splits the compressed stream into parts of at most `part_size` bytes, plus a JSON
+    manifest with sizes and sha256 checksums of every part and of the database itself.
+    """
+    started = time.time()
+    os.makedirs(out_dir, exist_ok=True)
+    stem = f"{os.path.splitext(os.path.basename(db_path))[0]}-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+    snapshot_path = os.path.join(out_dir, f"{stem}.snapshot.db")
+
+    # One backup step copies every page inside a single read transaction. In WAL mode that
+    # never blocks writers, and unlike a multi-step backup it cannot be restarted by them.
+    source = sqlite3.connect(db_path, timeout=DB_BUSY_TIMEOUT)
+    target = sqlite3.connect(snapshot_path)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+    parts = _PartWriter(os.path.join(out_dir, f"{stem}.db.gz"), part_size)
+    try:
+        db_size = os.path.getsize(snapshot_path)
+        db_sha256 = hashlib.sha256()
+        with open(snapshot_path, "rb") as src, \
+                gzip.GzipFile(filename=os.path.basename(db_path), mode="wb", fileobj=parts,
+                              compresslevel=BACKUP_COMPRESSION_LEVEL, mtime=0) as gz:
+            for chunk in iter(lambda: src.read(_CHUNK), b""):
+                db_sha256.update(chunk)
+                gz.write(chunk)
+        parts.close()
+    except BaseException:
+        parts.close()
+        for path in parts.paths:
+            os.remove(path)
+        raise
+    finally:
+        os.remove(snapshot_path)
+
+    manifest = {
+        "format": MANIFEST_FORMAT,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "database": os.path.basename(db_path),
+        "db_size": db_size,
+        "db_sha256": db_sha256.hexdigest(),
+        "compression": "gzip",
+        "parts": parts.parts,
+    }
+    manifest_path = os.path.join(out_dir, f"{stem}.manifest.json")
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+    result = BackupResult(manifest_path, parts.paths, db_size, sum(p["size"] for p in parts.parts),
+                          time.time() - started)
+    logger.info(f"Backup {stem}: {db_size / 1048576:.1f} MB -> {result.compressed_size / 1048576:.1f} MB "
+                f"in {len(result.part_paths)} part(s), {result.seconds:.1f}s")
+    return result
+
+
+def remove_backup(result: BackupResult) -> None:
+    for path in [*result.part_paths, result.manifest_path]:
+        try:
+            os.remove(path)
+        except OSError as e:
+            logger.warning(f"Could not remove backup file {path}: {e}")
+
+
+class _PartReader:
+    """Reads a list of part files back to back as one stream."""
+
+    def __init__(self, paths: List[str]):
+        self._paths = list(paths)
+        self._file: Optional[BinaryIO] = None
+
+    def read(self, size: int = -1) -> bytes:
+        while True:
+            if self._file is None:
+                if not self._paths:
+                    return b""
+                self._file = open(self._paths.pop(0), "rb")
+            data = self._file.read(size if size is not None and size >= 0 else _CHUNK)
+            if data:
+                return data
+            self._file.close()
+            self._file = None
+
+
+def restore_backup(manifest_path: str, target_path: str = DATABASE_PATH) -> None:
+    """
+    Reassembles and decompresses the parts of a backup, verifies every checksum and the
+    database's integrity, then atomically replaces `target_path`. Stop the bot first.
+    """
+    with open(manifest_path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format") != MANIFEST_FORMAT or manifest.get("compression") != "gzip":
+        raise ValueError(f"unsupported backup manifest {manifest_path}")
+
+    directory = os.path.dirname(os.path.abspath(manifest_path))
+    paths = []
+    for part in manifest["parts"]:
+        path = os.path.join(directory, part["name"])
+        if not os.path.exists(path):
+            raise ValueError(f"backup part {part['name']} is missing")
+        if os.path.getsize(path) != part["size"] or _sha256_file(path) != part["sha256"]:
+            raise ValueError(f"backup part {part['name']} is corrupt or incomplete")
+        paths.append(path)
+
+    tmp_path = f"{target_path}.restore"
+    digest = hashlib.sha256()
+    try:
+        with gzip.GzipFile(fileobj=_PartReader(paths), mode="rb") as gz, open(tmp_path, "wb") as out:
+            for chunk in iter(lambda: gz.read(_CHUNK), b""):
+                digest.update(chunk)
+                out.write(chunk)
+        if os.path.getsize(tmp_path) != manifest["db_size"] or digest.hexdigest() != manifest["db_sha256"]:
+            raise ValueError("restored database does not match the manifest checksum")
+        conn = sqlite3.connect(tmp_path)
+        try:
+            status = conn.execute("PRAGMA integrity_check").fetchone()[0]
+        finally:
+            conn.close()
+        if status != "ok":
+            raise ValueError(f"restored database failed integrity_check: {status}")
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    if os.path.exists(target_path):
+        shutil.copy2(target_path, f"{target_path}.before-restore")
+    # The old WAL/SHM belong to the replaced file and must not be replayed onto the restored one.
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(target_path + suffix):
+            os.remove(target_path + suffix)
+    os.replace(tmp_path, target_path)
+    logger.info(f"Restored {target_path} from {manifest_path} ({manifest['db_size']} bytes)")
+
+
+if __name__ == "__main__":
+    # python backup.py restore <manifest.json> [target.db]
+    if len(sys.argv) < 3 or sys.argv[1] != "restore":
+        sys.exit("usage: python backup.py restore <manifest.json> [target.db]")
+    logging.basicConfig(level=logging.INFO)
+    restore_backup(sys.argv[2], *sys.argv[3:4])
@@ -0,0 +1,71 @@
+"""
+Microbenchmark for normalizing a /user/ payload.
+
+Compares the per-user path (strptime + pytz.localize per timestamp and a clock read per user)
+with HiddifyAPIBase.normalize_users, which shares that work across the batch.
+
+    python bench_normalize.py [user_count]
+"""
+import random
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+from api_handler import HiddifyAPIBase
+from panel_user import PanelUser
+from utils import safe_float
+
+
+def _make_payload(count: int) -> list:
+    base = datetime(2025, 1, 1)
+    start_dates = [(base + timedelta(days=d)).strftime("%Y-%m-%d") for d in range(60)]
+    payload = []
+    for i in range(count):
+        last_online = base + timedelta(seconds=random.randint(0, 200 * 86400))
+        payload.append({
+            "uuid": f"{i:08x}-0000-4000-8000-{i:012x}",
+            "name": f"user-{i}",
+            "is_active": True,
+            "last_online": last_online.strftime("%Y-%m-%dT%H:%M:%S.%f") if i % 7 else None,
+            "usage_limit_GB": 50,
+            "current_usage_GB": random.random() * 50,
+            "start_date": random.choice(start_dates),
+            "package_days": 30,
+            "mode": "no_reset",
+        })
+    return payload
+
+
+def _per_user(api: HiddifyAPIBase, payload: list) -> list:
+    users = []
+    for raw in payload:
+        last_online = api._parse_api_datetime(raw.get("last_online"))
+        users.append(PanelUser(
+            name=raw.get("name") or "کاربر ناشناس",
+            uuid=raw.get("uuid", "").lower(),
+            is_active=bool(raw.get("is_active", raw.get("enable", False))),
+            last_online_ts=last_online.timestamp() if last_online else None,
+            usage_limit_GB=safe_float(raw.get("usage_limit_GB", 0)),
+            current_usage_GB=safe_float(raw.get("current_usage_GB", 0)),
+            expire=api._calculate_remaining_days(raw.get("start_date"), raw.get("package_days")),
+            mode=raw.get("mode", "no_reset"),
+        ))
+    return users
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    api = HiddifyAPIBase("https://panel.invalid", "bench", "bench")
+    payload = _make_payload(count)
+
+    slow, fast = _per_user(api, payload), api.normalize_users(payload)
+    assert [(u.last_online_ts, u.expire) for u in slow] == [(u.last_online_ts, u.expire) for u in fast]
+
+    for label, func in (("per-user", lambda: _per_user(api, payload)),
+                        ("batch", lambda: api.normalize_users(payload))):
+        best = min(timeit.repeat(func, number=1, repeat=5))
+        print(f"{label:>9}: {best * 1000:8.1f} ms for {count} users ({best / count * 1e6:.2f} µs/user)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Fails (exit status 1) if a hot query falls back to a full scan.
+
+Builds a throwaway database through DatabaseManager, so the real schema and migrations
+apply, fills it with synthetic users, UUIDs and usage history, and runs
+DatabaseManager.check_query_plans() on the SQL the methods actually execute (HOT_QUERIES),
+both without statistics and after ANALYZE, since the planner's choice can differ.
+
+    python check_query_plans.py [uuid_count]
+"""
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+import pytz
+
+
+def _populate(manager, uuid_count: int) -> None:
+    now = datetime.now(pytz.utc).replace(microsecond=0)
+    with manager._conn() as c:
+        c.executemany("INSERT INTO users (user_id, username, first_name, birthday, birthday_md) VALUES (?, ?, ?, ?, ?)",
+                      ((i, f"user{i}", f"User {i}", f"1990-{i % 12 + 1:02d}-{i % 28 + 1:02d}" if i % 3 == 0 else None,
+                        f"{i % 12 + 1:02d}-{i % 28 + 1:02d}" if i % 3 == 0 else None) for i in range(1, uuid_count + 1)))
+        c.executemany("INSERT INTO user_uuids (id, user_id, uuid, name, is_active) VALUES (?, ?, ?, ?, ?)",
+                      ((i, i, f"{i:08x}-0000-4000-8000-{i:012x}", f"acc{i}", int(i % 10 != 0)) for i in range(1, uuid_count + 1)))
+        c.executemany("INSERT INTO usage_snapshots (uuid_id, usage_gb, taken_at) VALUES (?, ?, ?)",
+                      ((uuid_id, random.random() * 100, now - timedelta(hours=hour))
+                       for uuid_id in range(1, uuid_count + 1) for hour in range(0, 72)))
+        c.executemany("INSERT INTO usage_daily (uuid_id, day, used_gb) VALUES (?, ?, ?)",
+                      ((uuid_id, (now - timedelta(days=day)).date().isoformat(), random.random())
+                       for uuid_id in range(1, uuid_count + 1) for day in range(0, 60)))
+        c.executemany("INSERT INTO scheduled_messages (job_type, chat_id, message_id) VALUES (?, ?, ?)",
+                      ((f"job{i % 8}", i, i) for i in range(1, uuid_count + 1)))
+
+
+def main() -> int:
+    uuid_count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    with tempfile.TemporaryDirectory() as tmp:
+        # database.py opens the module-level `db` on the relative DATABASE_PATH at import;
+        # importing from inside the temp dir keeps it away from the real bot_data.db.
+        os.chdir(tmp)
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        from database import DatabaseManager, HOT_QUERIES, db
+
+        manager = DatabaseManager(os.path.join(tmp, "plans.db"))
+        _populate(manager, uuid_count)
+        failed = False
+        for label in ("no statistics", "after ANALYZE"):
+            if label == "after ANALYZE":
+                with manager._conn() as c:
+                    c.execute("ANALYZE")
+            offenders = manager.check_query_plans()
+            for name, plan in offenders.items():
+                print(f"FAIL [{label}] {name}: {plan}")
+            failed = failed or bool(offenders)
+            print(f"{label}: {len(HOT_QUERIES) - len(offenders)}/{len(HOT_QUERIES)} hot queries index-served")
+        manager.close()
+        db.close()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
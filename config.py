@@ -1,7 +1,7 @@
+import json
 import os
 from datetime import time
 import pytz
-from cachetools import TTLCache
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -24,8 +24,48 @@ ADMIN_PROXY_PATH = ADMIN_PROXY_PATH_RAW.strip("/") if ADMIN_PROXY_PATH_RAW else
 ADMIN_UUID = os.getenv("ADMIN_UUID")
 ADMIN_IDS = _parse_admin_ids(os.getenv("ADMIN_IDS")) or {265455450}
 
+def _parse_hiddify_panels(raw_panels: str | None) -> list[dict]:
+    """
+    HIDDIFY_PANELS is a JSON list such as
+    [{"name": "de", "domain": "https://a.example", "proxy_path": "xyz", "api_key": "..."}, ...].
+    Without it the single panel from HIDDIFY_DOMAIN / ADMIN_PROXY_PATH / ADMIN_UUID is used.
+    """
+    default = [{"name": "main", "domain": HIDDIFY_DOMAIN, "proxy_path": ADMIN_PROXY_PATH, "api_key": ADMIN_UUID}]
+    if not raw_panels:
+        return default
+    try:
+        panels = []
+        for index, panel in enumerate(json.loads(raw_panels)):
+            panels.append({
+                "name": str(panel.get("name") or f"panel{index + 1}"),
+                "domain": panel["domain"].rstrip("/"),
+                "proxy_path": panel["proxy_path"].strip("/"),
+                "api_key": panel["api_key"],
+            })
+        if len({p["name"] for p in panels}) != len(panels):
+            raise ValueError("panel names must be unique")
+        return panels or default
+    except (ValueError, TypeError, KeyError, AttributeError) as e:
+        print(f"Warning: HIDDIFY_PANELS is invalid ({e}); using the single panel from HIDDIFY_DOMAIN.")
+        return default
+
+HIDDIFY_PANELS = _parse_hiddify_panels(os.getenv("HIDDIFY_PANELS"))
+
 # --- Paths & Time ---
 DATABASE_PATH = "bot_data.db"
+DB_CACHED_STATEMENTS = 256         # تعداد کوئری‌های آماده (prepared) که هر اتصال نگه می‌دارد
+DB_MMAP_SIZE = 64 * 1024 * 1024    # حجم فایل دیتابیس که با mmap خوانده می‌شود
+DB_BUSY_TIMEOUT = 10               # انتظار (ثانیه) برای آزاد شدن قفل نوشتن
+DB_WRITE_BATCH_SIZE = 200          # حداکثر تعداد نوشتن‌های صف که در یک تراکنش ثبت می‌شوند
+DB_WRITE_ACK_TIMEOUT = 30          # حداکثر انتظار (ثانیه) برای تأیید ثبت یک نوشتن
+DB_USER_CACHE_SIZE = 4096          # تعداد کاربرانی که ردیف و لیست UUIDهایشان در حافظه نگه داشته می‌شود
+DB_MAINTENANCE_INTERVAL_MINUTES = 5  # فاصله اجرای نگهداری دیتابیس (بازپس‌گیری صفحات آزاد)
+DB_VACUUM_PAGES_PER_TICK = 512       # حداکثر صفحات آزادی که در هر اجرا به سیستم‌عامل برگردانده می‌شوند
+DB_CHECKPOINT_QUIET_SECONDS = 60     # اگر این مدت نوشتنی نبوده، فایل WAL چک‌پوینت و کوتاه می‌شود
+# نگهداری تاریخچه مصرف: اسنپ‌شات‌های خام بعد از جمع‌بندی ساعتی و روزانه حذف می‌شوند
+USAGE_RAW_RETENTION_HOURS = 48     # اسنپ‌شات‌های خام (برای مصرف امروز و بازه‌های ۲۴ ساعته)
+USAGE_HOURLY_RETENTION_DAYS = 30   # جمع‌بندی ساعتی
+USAGE_DAILY_RETENTION_DAYS = 730   # جمع‌بندی روزانه (گزارش هفتگی و ماهانه)
 TEHRAN_TZ = pytz.timezone("Asia/Tehran")
 DAILY_REPORT_TIME = time(23, 59)
 CLEANUP_TIME = time(23, 59)
@@ -36,25 +76,57 @@ BIRTHDAY_GIFT_GB = 15  # حجم هدیه (گیگابایت)
 BIRTHDAY_GIFT_DAYS = 15 # تعداد روز هدیه
 
 TELEGRAM_FILE_SIZE_LIMIT_BYTES = 50 * 1024 * 1024
+BACKUP_DIR = "backups"                                               # پوشه موقت فایل‌های پشتیبان
+BACKUP_PART_SIZE_BYTES = TELEGRAM_FILE_SIZE_LIMIT_BYTES - 1024 * 1024  # هر بخش کمی کمتر از سقف تلگرام
+BACKUP_COMPRESSION_LEVEL = 6                                          # سطح فشرده‌سازی gzip (۱ سریع‌تر، ۹ کوچک‌تر)
 
 CUSTOM_SUB_LINK_BASE_URL = "https://drive.google.com/uc?export=download&id="
 
-# --- تعریف یک کش با زمان انقضای ۶۰ ثانیه ---
-# maxsize=2 یعنی حداکثر ۲ نتیجه متفاوت (معمولاً ۱ نتیجه get_all_users) را نگه می‌دارد
-api_cache = TTLCache(maxsize=2, ttl=60)
+# --- دایرکتوری کاربران پنل (جایگزین کش ۶۰ ثانیه‌ای get_all_users) ---
+USER_DIRECTORY_TTL = 60            # بعد از این مدت (ثانیه) لیست در پس‌زمینه تازه‌سازی می‌شود
+USER_DIRECTORY_RETRY_SECONDS = 15  # فاصله تلاش مجدد پس از خطای پنل
+USER_DIRECTORY_WAIT_TIMEOUT = 60   # حداکثر انتظار برای اولین دریافت لیست
+USER_DIRECTORY_SNAPSHOT_PATH = "directory_{name}.snap"  # آخرین لیست سالم برای شروع سریع پس از ری‌استارت
 
 WARNING_USAGE_THRESHOLD = 85 # آستانه هشدار مصرف به درصد
 NOTIFY_ADMIN_ON_USAGE = True # فعال/غیرفعال کردن این قابلیت
 
 USAGE_WARNING_CHECK_HOURS = 4    # فاصله زمانی چک کردن هشدار مصرف (به ساعت)
+USAGE_WARNING_NOTIFY_ONCE = False  # True: هر کاربر فقط یک بار هنگام عبور از آستانه گزارش شود؛ False: در هر گزارش دوره‌ای همه کاربران بالای آستانه
 ONLINE_REPORT_UPDATE_HOURS = 3 # فاصله زمانی آپدیت گزارش کاربران آنلاین (به ساعت)
 
 WARNING_90_PERCENT = 90
 WARNING_DAYS_BEFORE_EXPIRY = 2
 
+# آستانه‌هایی (درصد مصرف) که عبور از آن‌ها بین دو دریافت لیست کاربران، رویداد تولید می‌کند
+USAGE_EVENT_THRESHOLDS = (WARNING_USAGE_THRESHOLD, WARNING_90_PERCENT, 100)
+
 # --- API Settings ---
 API_TIMEOUT = 15
 API_RETRY_COUNT = 3
+API_POOL_SIZE = 16        # تعداد اتصالات keep-alive نگهداری‌شده در کانکشن‌پول
+API_STREAM_USER_LIST = True       # لیست کامل کاربران به صورت جریانی خوانده و نرمال‌سازی شود
+API_STREAM_CHUNK_SIZE = 64 * 1024
+API_BREAKER_FAILURE_THRESHOLD = 5  # تعداد خطای پیاپی (timeout/5xx) تا باز شدن مدار و رد سریع درخواست‌ها
+API_BREAKER_RESET_SECONDS = 30     # پس از این مدت یک درخواست آزمایشی برای بررسی بازگشت پنل ارسال می‌شود
+API_BULK_WORKERS = 8      # تعداد ویرایش همزمان کاربران در عملیات گروهی (مثل هدیه تولد)
+API_BULK_RETRIES = 2      # تلاش مجدد برای هر کاربر در عملیات گروهی
+FEDERATION_LOOKUP_TIMEOUT = 20  # حداکثر انتظار برای یافتن پنل یک UUID ناشناس در حالت چند پنلی
+USER_INFO_CACHE_TTL = 30        # اطلاعات هر کاربر حداکثر این مدت (ثانیه) از کش یا لیست کامل خوانده می‌شود
+USER_INFO_CACHE_SIZE = 4096
+
+# --- Marzban ---
+MARZBAN_API_BASE_URL = (os.getenv("MARZBAN_API_BASE_URL") or "").rstrip("/")
+MARZBAN_API_USERNAME = os.getenv("MARZBAN_API_USERNAME")
+MARZBAN_API_PASSWORD = os.getenv("MARZBAN_API_PASSWORD")
+MARZBAN_PAGE_SIZE = 500               # تعداد کاربر در هر صفحه هنگام دریافت کامل /api/users
+MARZBAN_TOKEN_REFRESH_MARGIN = 60     # توکن این تعداد ثانیه قبل از انقضا تمدید می‌شود
+MARZBAN_DEFAULT_TOKEN_TTL = 30 * 60   # اگر زمان انقضای توکن مشخص نبود
+
+# --- نمایش اکانت (ترکیب Hiddify و Marzban) ---
+ACCOUNT_LOOKUP_DEADLINE = 10   # حداکثر انتظار مشترک برای پاسخ هر دو پنل (ثانیه)
+ACCOUNT_CACHE_TTL = 30         # مدت نگهداری نتیجه ترکیبی هر UUID
+ACCOUNT_CACHE_SIZE = 2048
 
 # --- Emojis & Visuals ---
 EMOJIS = {
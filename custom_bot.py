@@ -102,11 +102,18 @@ class HiddifyBot:
             register_callback_router(self.bot)
             logger.info("✅ Handlers registered")
 
-            logger.info("Testing API connectivity …")
-            if api_handler.test_connection():
-                logger.info("✅ API reachable")
+            directory = api_handler.directory
+            if directory.restored:
+                # با snapshot ذخیره‌شده بلافاصله پاسخ می‌دهیم و تازه‌سازی در پس‌زمینه انجام می‌شود
+                directory.refresh(wait=False)
+                logger.warning(f"⚠️ Serving the saved user snapshot (aged {directory.age():.0f}s) "
+                               f"while the panel is refreshed in the background")
             else:
-                logger.warning("⚠️ API unreachable")
+                logger.info("Testing API connectivity and warming the user directory …")
+                if directory.refresh():
+                    logger.info("✅ API reachable")
+                else:
+                    logger.warning("⚠️ API unreachable")
 
             db.user(0)  # Test DB connection
             logger.info("✅ SQLite ready (users table reachable)")
@@ -142,6 +149,12 @@ class HiddifyBot:
             logger.info("Scheduler stopped")
             self.bot.stop_polling()
             logger.info("Telegram polling stopped")
+            if db.flush_writes():
+                logger.info("Pending SQLite writes flushed")
+            else:
+                logger.warning("Timed out flushing pending SQLite writes")
+            db.close()
+            logger.info("SQLite connections closed")
             if self.started_at:
                 logger.info("Uptime: %s", datetime.now() - self.started_at)
         finally:
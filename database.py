@@ -1,23 +1,270 @@
+import os
+import re
 import sqlite3
+import threading
+import time
+from concurrent.futures import Future
 from datetime import datetime, timedelta
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
 import logging
 import pytz
 
+from db_writer import WriteBehindWriter
+from migrations import migrate
+from read_cache import ReadThroughCache
+from config import (DATABASE_PATH, DB_CACHED_STATEMENTS, DB_MMAP_SIZE, DB_BUSY_TIMEOUT, DB_WRITE_ACK_TIMEOUT, TEHRAN_TZ,
+                    DB_VACUUM_PAGES_PER_TICK, DB_CHECKPOINT_QUIET_SECONDS, DB_USER_CACHE_SIZE,
+                    USAGE_RAW_RETENTION_HOURS, USAGE_HOURLY_RETENTION_DAYS, USAGE_DAILY_RETENTION_DAYS, PAGE_SIZE)
+
 logger = logging.getLogger(__name__)
 
+
+def _tehran_hour_start(ts: float) -> int:
+    """Epoch seconds of the start of the Tehran-local hour containing `ts`."""
+    local = datetime.fromtimestamp(ts, TEHRAN_TZ)
+    return int(ts) - local.minute * 60 - local.second
+
+
+def _tehran_day(ts: float) -> str:
+    return datetime.fromtimestamp(ts, TEHRAN_TZ).date().isoformat()
+
+
+def _usage_delta(previous: Optional[float], current: float) -> float:
+    """Usage between two counter readings. A drop means the counter was reset, so the new reading is all new usage."""
+    if previous is None:
+        return 0.0
+    return current - previous if current >= previous else current
+
+
+class Page(NamedTuple):
+    """
+    One page of a keyset-paginated list. `prev_cursor`/`next_cursor` are opaque tokens
+    ('b<key>' / 'a<key>') that fetch the neighbouring page by seeking from its first/last key.
+    """
+    rows: List[Dict[str, Any]]
+    total: int
+    prev_cursor: Optional[str]
+    next_cursor: Optional[str]
+
+
+def _split_cursor(cursor: Optional[str], parse: Callable[[str], Any]) -> Tuple[Optional[str], Any]:
+    """('a' | 'b', parsed key) for a Page cursor, or (None, None) if it is missing or malformed."""
+    if cursor and cursor[0] in ("a", "b"):
+        try:
+            return cursor[0], parse(cursor[1:])
+        except ValueError:
+            pass
+    return None, None
+
+
+def _birthday_key(key: str) -> Tuple[str, int]:
+    month_day, _, user_id = key.partition(".")
+    return month_day, int(user_id)
+
+
+# Today's first and last reading per account. The taken_at range is read first and grouped
+# by account (`+uuid_id` keeps the planner from walking the whole (uuid_id, taken_at) index
+# in uuid order instead), then both readings are looked up by (uuid_id, taken_at).
+DAILY_USAGE_MAP_SQL = """
+    WITH bounds AS (
+        SELECT uuid_id, MIN(taken_at) AS first_at, MAX(taken_at) AS last_at
+        FROM usage_snapshots
+        WHERE taken_at >= ?
+        GROUP BY +uuid_id
+    )
+    SELECT uu.uuid AS uuid, last_snap.usage_gb - first_snap.usage_gb AS used
+    FROM bounds b
+    JOIN usage_snapshots first_snap ON first_snap.uuid_id = b.uuid_id AND first_snap.taken_at = b.first_at
+    JOIN usage_snapshots last_snap ON last_snap.uuid_id = b.uuid_id AND last_snap.taken_at = b.last_at
+    JOIN user_uuids uu ON uu.id = b.uuid_id
+    {uuid_filter}
+"""
+
+USAGE_SINCE_MIDNIGHT_SQL = """
+    SELECT
+        (SELECT usage_gb FROM usage_snapshots WHERE uuid_id = ? AND taken_at >= ? ORDER BY taken_at ASC LIMIT 1) as start_usage,
+        (SELECT usage_gb FROM usage_snapshots WHERE uuid_id = ? AND taken_at >= ? ORDER BY taken_at DESC LIMIT 1) as end_usage
+"""
+
+# {sums} is one SUM(CASE WHEN taken_at >= ? ...) column per window, see window_usages.
+WINDOW_USAGES_SQL = """
+    WITH readings AS (
+        SELECT taken_at, usage_gb, LAG(usage_gb) OVER (ORDER BY taken_at) AS prev
+        FROM usage_snapshots
+        WHERE uuid_id = ?
+          AND taken_at >= COALESCE((SELECT MAX(taken_at) FROM usage_snapshots WHERE uuid_id = ? AND taken_at < ?), ?)
+    ), deltas AS (
+        SELECT taken_at,
+               CASE WHEN prev IS NULL THEN 0
+                    WHEN usage_gb >= prev THEN usage_gb - prev
+                    ELSE usage_gb END AS delta
+        FROM readings
+    )
+    SELECT {sums} FROM deltas
+"""
+
+ROLLUP_RANGE_SQL = """
+    SELECT uuid_id, usage_gb, CAST(strftime('%s', taken_at) AS INTEGER) AS ts
+    FROM usage_snapshots
+    WHERE taken_at >= ? AND taken_at < ?
+    ORDER BY uuid_id, taken_at
+"""
+PRUNE_RAW_SQL = "DELETE FROM usage_snapshots WHERE taken_at < ?"
+PRUNE_HOURLY_SQL = "DELETE FROM usage_hourly WHERE hour_start < ?"
+PRUNE_DAILY_SQL = "DELETE FROM usage_daily WHERE day < ?"
+DAILY_HISTORY_SQL = "SELECT day, used_gb FROM usage_daily WHERE uuid_id = ? AND day >= ? ORDER BY day"
+PERIOD_ROLLED_SQL = "SELECT COALESCE(SUM(used_gb), 0) AS used FROM usage_daily WHERE uuid_id = ? AND day >= ?"
+PERIOD_TAIL_SQL = "SELECT usage_gb FROM usage_snapshots WHERE uuid_id = ? AND taken_at >= ? ORDER BY taken_at"
+
+UUID_ID_BY_UUID_SQL = "SELECT id FROM user_uuids WHERE uuid = ?"
+USER_UUIDS_SQL = "SELECT * FROM user_uuids WHERE user_id=? AND is_active=1 ORDER BY created_at"
+ALL_ACTIVE_UUIDS_SQL = "SELECT id, user_id, uuid, created_at FROM user_uuids WHERE is_active=1"
+UUID_TO_USER_ID_SQL = "SELECT uuid, user_id FROM user_uuids WHERE is_active=1"
+SCHEDULED_MESSAGES_SQL = "SELECT * FROM scheduled_messages WHERE job_type=?"
+TODAYS_BIRTHDAYS_SQL = "SELECT user_id FROM users WHERE birthday_md = ?"
+
+BOT_USER_COLUMNS = "user_id, username, first_name, last_name"
+BOT_USERS_AFTER_SQL = f"SELECT {BOT_USER_COLUMNS} FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?"
+BOT_USERS_BEFORE_SQL = f"SELECT {BOT_USER_COLUMNS} FROM users WHERE user_id < ? ORDER BY user_id DESC LIMIT ?"
+BIRTHDAY_COLUMNS = "user_id, first_name, username, birthday, birthday_md"
+BIRTHDAYS_AFTER_SQL = f"""
+    SELECT {BIRTHDAY_COLUMNS} FROM users
+    WHERE birthday_md IS NOT NULL AND (birthday_md, user_id) > (?, ?)
+    ORDER BY birthday_md, user_id LIMIT ?
+"""
+BIRTHDAYS_BEFORE_SQL = f"""
+    SELECT {BIRTHDAY_COLUMNS} FROM users
+    WHERE birthday_md IS NOT NULL AND (birthday_md, user_id) < (?, ?)
+    ORDER BY birthday_md DESC, user_id DESC LIMIT ?
+"""
+
+
+_ALIAS_RE = re.compile(r"\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(?!(?:WHERE|ON|JOIN|LEFT|INNER|CROSS|GROUP|ORDER|LIMIT|USING)\b)(\w+))?",
+                       re.IGNORECASE)
+
+
+def _table_aliases(sql: str) -> Dict[str, str]:
+    """{alias: name} for every `FROM/JOIN name [AS] alias` in `sql`."""
+    return {alias: name for name, alias in _ALIAS_RE.findall(sql) if alias}
+
+
+class HotQuery(NamedTuple):
+    sql: str
+    index_scan_ok: bool = False  # True only where reading a whole (partial) index is the point
+
+
+# The SQL the hot paths actually run (the constants above), checked at startup and by
+# check_query_plans.py. None may scan a table, under its own name or an alias; unless
+# `index_scan_ok`, none may scan a whole index either: they must seek a uuid_id/taken_at/key range.
+HOT_QUERIES: Dict[str, HotQuery] = {
+    "usage_since_midnight": HotQuery(USAGE_SINCE_MIDNIGHT_SQL),
+    "window_usages": HotQuery(WINDOW_USAGES_SQL.format(sums="COALESCE(SUM(CASE WHEN taken_at >= ? THEN delta END), 0)")),
+    "daily_usage_map": HotQuery(DAILY_USAGE_MAP_SQL.format(uuid_filter="")),
+    "daily_usage_map_uuids": HotQuery(DAILY_USAGE_MAP_SQL.format(uuid_filter="WHERE uu.uuid IN (?, ?, ?)")),
+    "rollup_range": HotQuery(ROLLUP_RANGE_SQL),
+    "prune_raw": HotQuery(PRUNE_RAW_SQL),
+    "prune_hourly": HotQuery(PRUNE_HOURLY_SQL),
+    "prune_daily": HotQuery(PRUNE_DAILY_SQL),
+    "daily_history": HotQuery(DAILY_HISTORY_SQL),
+    "period_rolled": HotQuery(PERIOD_ROLLED_SQL),
+    "period_tail": HotQuery(PERIOD_TAIL_SQL),
+    "uuid_id_by_uuid": HotQuery(UUID_ID_BY_UUID_SQL),
+    "uuids_of_user": HotQuery(USER_UUIDS_SQL),
+    "all_active_uuids": HotQuery(ALL_ACTIVE_UUIDS_SQL, index_scan_ok=True),
+    "uuid_to_user_id_map": HotQuery(UUID_TO_USER_ID_SQL, index_scan_ok=True),
+    "scheduled_messages": HotQuery(SCHEDULED_MESSAGES_SQL),
+    "todays_birthdays": HotQuery(TODAYS_BIRTHDAYS_SQL),
+    "bot_users_after": HotQuery(BOT_USERS_AFTER_SQL),
+    "bot_users_before": HotQuery(BOT_USERS_BEFORE_SQL),
+    "birthdays_after": HotQuery(BIRTHDAYS_AFTER_SQL),
+    "birthdays_before": HotQuery(BIRTHDAYS_BEFORE_SQL),
+}
+
+
 class DatabaseManager:
-    def __init__(self, path: str = "bot_data.db"):
+    """
+    Every thread gets one persistent connection, opened on first use with the PRAGMAs applied
+    once. `with self._conn() as c` still commits (or rolls back) on exit, so method bodies work
+    as before; only the per-call connect/PRAGMA cost is gone. Connections of threads that have
+    exited are closed the next time a thread connects; close() closes all of them.
+
+    Every interactive write (users, settings, birthdays, UUIDs, scheduled messages) and the
+    hourly snapshot batch goes through `self.writer`, a single write-behind thread that
+    commits them in batched transactions (see db_writer.WriteBehindWriter), so handler
+    threads never compete with it for the write lock. Upserts of users, settings and
+    scheduled messages return the Future immediately; the others wait for the commit.
+    Only the scheduled rollup/prune jobs and maintenance write on their own connection.
+
+    User rows (which also hold the settings) and active-UUID lists are served from LRU
+    read-through caches keyed by user_id. Every method that writes to users/user_uuids
+    invalidates exactly the affected user_id once its write has committed.
+    """
+
+    def __init__(self, path: str = DATABASE_PATH):
         self.path = path
+        self._local = threading.local()
+        self._connections: Dict[int, Tuple[threading.Thread, sqlite3.Connection]] = {}
+        self._connections_lock = threading.Lock()
+        self._generation = 0
+        self._user_cache = ReadThroughCache(DB_USER_CACHE_SIZE, "users")
+        self._uuids_cache = ReadThroughCache(DB_USER_CACHE_SIZE, "uuids")
+        self._maintenance: Dict[str, Any] = {"runs": 0, "pages_reclaimed": 0, "vacuum_seconds": 0.0,
+                                             "checkpoints": 0, "checkpoint_seconds": 0.0, "last_checkpoint": None,
+                                             "last_reclaimed": 0, "last_run_seconds": None}
         self._init_db()
+        self.writer = WriteBehindWriter(self._connect)
 
-    def _conn(self) -> sqlite3.Connection:
-        conn = sqlite3.connect(self.path, detect_types=sqlite3.PARSE_DECLTYPES)
+    def _connect(self) -> sqlite3.Connection:
+        # check_same_thread=False only so close() can close it from another thread;
+        # each connection is still used by the thread that opened it.
+        conn = sqlite3.connect(self.path, detect_types=sqlite3.PARSE_DECLTYPES, timeout=DB_BUSY_TIMEOUT,
+                               cached_statements=DB_CACHED_STATEMENTS, check_same_thread=False)
         conn.execute("PRAGMA journal_mode=WAL")
         conn.execute("PRAGMA foreign_keys = ON;")
+        conn.execute("PRAGMA synchronous = NORMAL;")
+        conn.execute(f"PRAGMA mmap_size = {int(DB_MMAP_SIZE)};")
         conn.row_factory = sqlite3.Row
         return conn
 
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.generation == self._generation:
+            return conn
+        conn = self._connect()
+        current = threading.current_thread()
+        with self._connections_lock:
+            stale = [ident for ident, (thread, _) in self._connections.items() if not thread.is_alive()]
+            for ident in stale:
+                self._connections.pop(ident)[1].close()
+            self._connections[current.ident] = (current, conn)
+            self._local.conn, self._local.generation = conn, self._generation
+        return conn
+
+    def _write(self, job: Callable[[sqlite3.Connection], Any], wait: bool = False,
+               on_commit: Optional[Callable[[], None]] = None) -> Any:
+        """Queues `job(conn)` on the writer. With wait=True blocks until committed and returns its result."""
+        future = self.writer.submit(job, on_commit)
+        return future.result(DB_WRITE_ACK_TIMEOUT) if wait else future
+
+    def flush_writes(self, timeout: Optional[float] = DB_WRITE_ACK_TIMEOUT) -> bool:
+        """Waits until every queued write is committed."""
+        return self.writer.flush(timeout)
+
+    def close(self) -> None:
+        """
+        Commits queued writes, stops the writer and closes every thread's connection;
+        later calls transparently reconnect (writes then run synchronously).
+        """
+        self.writer.close(DB_WRITE_ACK_TIMEOUT)
+        with self._connections_lock:
+            self._generation += 1
+            connections, self._connections = list(self._connections.values()), {}
+        for _, conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                logger.warning(f"Closing SQLite connection failed: {e}")
+
     def _init_db(self) -> None:
         with self._conn() as c:
             c.executescript("""
@@ -47,6 +294,32 @@ CREATE TABLE IF NOT EXISTS usage_snapshots (
     taken_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY(uuid_id) REFERENCES user_uuids(id) ON DELETE CASCADE
 );
+CREATE TABLE IF NOT EXISTS usage_hourly (
+    uuid_id INTEGER NOT NULL,
+    hour_start INTEGER NOT NULL,
+    used_gb REAL NOT NULL DEFAULT 0,
+    last_usage_gb REAL,
+    samples INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (uuid_id, hour_start),
+    FOREIGN KEY(uuid_id) REFERENCES user_uuids(id) ON DELETE CASCADE
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS usage_daily (
+    uuid_id INTEGER NOT NULL,
+    day TEXT NOT NULL,
+    used_gb REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (uuid_id, day),
+    FOREIGN KEY(uuid_id) REFERENCES user_uuids(id) ON DELETE CASCADE
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS usage_rollup_counters (
+    uuid_id INTEGER PRIMARY KEY,
+    usage_gb REAL NOT NULL,
+    taken_at INTEGER NOT NULL,
+    FOREIGN KEY(uuid_id) REFERENCES user_uuids(id) ON DELETE CASCADE
+);
+CREATE TABLE IF NOT EXISTS usage_rollup_progress (
+    tier TEXT PRIMARY KEY,
+    done_until INTEGER NOT NULL
+);
 CREATE TABLE IF NOT EXISTS scheduled_messages (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     job_type TEXT NOT NULL,
@@ -56,12 +329,37 @@ CREATE TABLE IF NOT EXISTS scheduled_messages (
     UNIQUE(job_type, chat_id)
 );
     -- افزودن ایندکس‌ها برای افزایش سرعت کوئری‌ها
-    CREATE INDEX IF NOT EXISTS idx_user_uuids_uuid ON user_uuids(uuid);
     CREATE INDEX IF NOT EXISTS idx_user_uuids_user_id ON user_uuids(user_id);
-    CREATE INDEX IF NOT EXISTS idx_snapshots_uuid_id_taken_at ON usage_snapshots(uuid_id, taken_at);
+    CREATE INDEX IF NOT EXISTS idx_usage_hourly_hour_start ON usage_hourly(hour_start);
+    CREATE INDEX IF NOT EXISTS idx_usage_daily_day ON usage_daily(day);
     CREATE INDEX IF NOT EXISTS idx_scheduled_messages_job_type ON scheduled_messages(job_type);
 """)
-        logger.info("SQLite schema and indexes are ready.")
+            version = migrate(c)
+        for name, plan in self.check_query_plans().items():
+            logger.warning(f"Hot query '{name}' does a full scan: {plan}")
+        logger.info(f"SQLite schema (version {version}) and indexes are ready.")
+
+    def check_query_plans(self) -> Dict[str, str]:
+        """
+        Runs EXPLAIN QUERY PLAN for every query in HOT_QUERIES and returns {name: plan} for the
+        ones that scan a table, or scan a whole index where a seek is expected (see HotQuery).
+        Empty means every hot path is index-served.
+        """
+        offenders = {}
+        with self._conn() as c:
+            tables = {row['name'] for row in c.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            for name, query in HOT_QUERIES.items():
+                params = (None,) * query.sql.count("?")
+                details = [row['detail'] for row in c.execute(f"EXPLAIN QUERY PLAN {query.sql}", params)]
+                aliases = _table_aliases(query.sql)
+                for detail in details:
+                    words = detail.split()
+                    # Plans name tables by their alias; CTEs, subqueries and CONSTANT ROW are not tables.
+                    scanned = aliases.get(words[1], words[1]) if words[0] == "SCAN" else None
+                    if scanned in tables and not (query.index_scan_ok and "INDEX" in words):
+                        offenders[name] = "; ".join(details)
+                        break
+        return offenders
 
     def get_user_ids_by_uuids(self, uuids: List[str]) -> List[int]:
         """Fetches distinct Telegram user_ids for a given list of UUIDs."""
@@ -76,23 +374,27 @@ CREATE TABLE IF NOT EXISTS scheduled_messages (
             return [row['user_id'] for row in rows]
         
     def window_usage(self, uuid_id: int, hours_ago: int) -> float:
-        """Calculates the usage difference in a given time window (in hours)."""
-        start_time_utc = datetime.now(pytz.utc) - timedelta(hours=hours_ago)
-        
-        with self._conn() as c:
-            # Find the earliest and latest snapshots within the time window
-            query = """
-                SELECT MIN(usage_gb) as start_usage, MAX(usage_gb) as end_usage
-                FROM usage_snapshots
-                WHERE uuid_id = ? AND taken_at >= ?
-            """
-            row = c.execute(query, (uuid_id, start_time_utc)).fetchone()
+        """Calculates the usage in the last `hours_ago` hours (see window_usages)."""
+        return self.window_usages(uuid_id, [hours_ago])[hours_ago]
 
-            if row and row['start_usage'] is not None and row['end_usage'] is not None:
-                # The usage is the difference between the last and first snapshot
-                return max(0, row['end_usage'] - row['start_usage'])
-            
-            return 0.0
+    def window_usages(self, uuid_id: int, hours: Iterable[int]) -> Dict[int, float]:
+        """
+        Usage of one account in several trailing windows ({hours: GB}), in a single pass over
+        the snapshots of the longest window. Each reading contributes its delta to the previous
+        one (the reading just before the window included), and a drop counts as a counter reset,
+        so resets inside a window don't zero or negate the result. Windows longer than
+        USAGE_RAW_RETENTION_HOURS only see the raw snapshots still kept.
+        """
+        hours = sorted(set(hours))
+        if not hours:
+            return {}
+        now = datetime.now(pytz.utc)
+        starts = [now - timedelta(hours=h) for h in hours]
+        sums = ",\n".join(f"COALESCE(SUM(CASE WHEN taken_at >= ? THEN delta END), 0) AS w{i}" for i in range(len(hours)))
+        oldest = starts[-1]
+        with self._conn() as c:
+            row = c.execute(WINDOW_USAGES_SQL.format(sums=sums), (uuid_id, uuid_id, oldest, oldest, *starts)).fetchone()
+        return {h: max(0.0, row[i]) for i, h in enumerate(hours)}
 
     def get_usage_since_midnight(self, uuid_id: int) -> float:
         """Calculates usage difference since midnight TEHRAN time correctly."""
@@ -101,150 +403,236 @@ CREATE TABLE IF NOT EXISTS scheduled_messages (
         today_midnight_utc = today_midnight_tehran.astimezone(pytz.utc)
         
         with self._conn() as c:
-            query = """
-                SELECT
-                    (SELECT usage_gb FROM usage_snapshots WHERE uuid_id = ? AND taken_at >= ? ORDER BY taken_at ASC LIMIT 1) as start_usage,
-                    (SELECT usage_gb FROM usage_snapshots WHERE uuid_id = ? AND taken_at >= ? ORDER BY taken_at DESC LIMIT 1) as end_usage
-            """
             params = (uuid_id, today_midnight_utc, uuid_id, today_midnight_utc)
-            row = c.execute(query, params).fetchone()
+            row = c.execute(USAGE_SINCE_MIDNIGHT_SQL, params).fetchone()
 
             if row and row['start_usage'] is not None and row['end_usage'] is not None:
                 return max(0, row['end_usage'] - row['start_usage'])
             
             return 0.0
 
+    def get_daily_usage_map(self, uuids: Optional[Iterable[str]] = None) -> Dict[str, float]:
+        """
+        Today's usage (since midnight Tehran time) per UUID in one grouped query, for every UUID
+        or only the given ones. Same rule as get_usage_since_midnight: latest minus earliest
+        snapshot of the day, never negative. UUIDs without snapshots today are omitted.
+        """
+        tehran_tz = pytz.timezone("Asia/Tehran")
+        today_midnight_utc = datetime.now(tehran_tz).replace(hour=0, minute=0, second=0, microsecond=0).astimezone(pytz.utc)
+
+        params: List[Any] = [today_midnight_utc]
+        uuid_filter = ""
+        if uuids is not None:
+            uuids = list(set(uuids))
+            if not uuids:
+                return {}
+            if len(uuids) <= 900:  # بیشتر از این، همه را می‌گیریم و در پایتون فیلتر می‌کنیم
+                uuid_filter = f"WHERE uu.uuid IN ({','.join('?' for _ in uuids)})"
+                params.extend(uuids)
+
+        with self._conn() as c:
+            rows = c.execute(DAILY_USAGE_MAP_SQL.format(uuid_filter=uuid_filter), params).fetchall()
+        usage = {row['uuid']: max(0.0, row['used'] or 0.0) for row in rows}
+        if uuids is not None and not uuid_filter:
+            wanted = set(uuids)
+            usage = {uuid: used for uuid, used in usage.items() if uuid in wanted}
+        return usage
+
     def get_uuid_id_by_uuid(self, uuid_str: str) -> Optional[int]:
         with self._conn() as c:
-            row = c.execute("SELECT id FROM user_uuids WHERE uuid = ?", (uuid_str,)).fetchone()
+            row = c.execute(UUID_ID_BY_UUID_SQL, (uuid_str,)).fetchone()
             return row['id'] if row else None
 
     def get_usage_since_midnight_by_uuid(self, uuid_str: str) -> float:
         uuid_id = self.get_uuid_id_by_uuid(uuid_str)
         return self.get_usage_since_midnight(uuid_id) if uuid_id else 0.0
 
-    def add_or_update_scheduled_message(self, job_type: str, chat_id: int, message_id: int):
-        with self._conn() as c:
-            c.execute(
-                "INSERT INTO scheduled_messages(job_type, chat_id, message_id) VALUES(?,?,?) "
-                "ON CONFLICT(job_type, chat_id) DO UPDATE SET message_id=excluded.message_id, created_at=CURRENT_TIMESTAMP",
-                (job_type, chat_id, message_id)
-            )
+    def add_or_update_scheduled_message(self, job_type: str, chat_id: int, message_id: int) -> Future:
+        return self._write(lambda c: c.execute(
+            "INSERT INTO scheduled_messages(job_type, chat_id, message_id) VALUES(?,?,?) "
+            "ON CONFLICT(job_type, chat_id) DO UPDATE SET message_id=excluded.message_id, created_at=CURRENT_TIMESTAMP",
+            (job_type, chat_id, message_id)
+        ))
 
     def get_scheduled_messages(self, job_type: str) -> List[Dict[str, Any]]:
         with self._conn() as c:
-            rows = c.execute("SELECT * FROM scheduled_messages WHERE job_type=?", (job_type,)).fetchall()
+            rows = c.execute(SCHEDULED_MESSAGES_SQL, (job_type,)).fetchall()
             return [dict(r) for r in rows]
 
     def delete_scheduled_message(self, job_id: int):
-        with self._conn() as c:
-            c.execute("DELETE FROM scheduled_messages WHERE id=?", (job_id,))
+        self._write(lambda c: c.execute("DELETE FROM scheduled_messages WHERE id=?", (job_id,)), wait=True)
             
+    def _cached_user(self, user_id: int) -> Optional[Dict[str, Any]]:
+        def load() -> Optional[Dict[str, Any]]:
+            with self._conn() as c:
+                row = c.execute("SELECT * FROM users WHERE user_id=?", (user_id,)).fetchone()
+                return dict(row) if row else None
+        return self._user_cache.get(user_id, load)
+
     def user(self, user_id: int) -> Optional[Dict[str, Any]]:
-        with self._conn() as c:
-            row = c.execute("SELECT * FROM users WHERE user_id=?", (user_id,)).fetchone()
-            return dict(row) if row else None
+        row = self._cached_user(user_id)
+        return dict(row) if row else None
 
-    def add_or_update_user(self, user_id: int, username: Optional[str], first: Optional[str], last: Optional[str]) -> None:
-        with self._conn() as c:
-            c.execute(
-                "INSERT INTO users(user_id, username, first_name, last_name) VALUES(?,?,?,?) "
-                "ON CONFLICT(user_id) DO UPDATE SET username=excluded.username, first_name=excluded.first_name, last_name=excluded.last_name",
-                (user_id, username, first, last),
-            )
+    def add_or_update_user(self, user_id: int, username: Optional[str], first: Optional[str], last: Optional[str]) -> Future:
+        return self._write(lambda c: c.execute(
+            "INSERT INTO users(user_id, username, first_name, last_name) VALUES(?,?,?,?) "
+            "ON CONFLICT(user_id) DO UPDATE SET username=excluded.username, first_name=excluded.first_name, last_name=excluded.last_name",
+            (user_id, username, first, last),
+        ), on_commit=lambda: self._user_cache.invalidate(user_id))
 
     def get_user_settings(self, user_id: int) -> Dict[str, bool]:
-        with self._conn() as c:
-            row = c.execute("SELECT daily_reports, expiry_warnings FROM users WHERE user_id=?", (user_id,)).fetchone()
-            if row:
-                return {'daily_reports': bool(row['daily_reports']), 'expiry_warnings': bool(row['expiry_warnings'])}
-            return {'daily_reports': True, 'expiry_warnings': True}
+        row = self._cached_user(user_id)
+        if row:
+            return {'daily_reports': bool(row['daily_reports']), 'expiry_warnings': bool(row['expiry_warnings'])}
+        return {'daily_reports': True, 'expiry_warnings': True}
 
-    def update_user_setting(self, user_id: int, setting: str, value: bool) -> None:
-        if setting not in ['daily_reports', 'expiry_warnings']: return
-        with self._conn() as c:
-            c.execute(f"UPDATE users SET {setting}=? WHERE user_id=?", (int(value), user_id))
+    def update_user_setting(self, user_id: int, setting: str, value: bool) -> Optional[Future]:
+        if setting not in ['daily_reports', 'expiry_warnings']: return None
+        return self._write(lambda c: c.execute(f"UPDATE users SET {setting}=? WHERE user_id=?", (int(value), user_id)),
+                           on_commit=lambda: self._user_cache.invalidate(user_id))
 
     def add_uuid(self, user_id: int, uuid_str: str, name: str) -> str:
         uuid_str = uuid_str.lower()
-        with self._conn() as c:
-            existing = c.execute("SELECT * FROM user_uuids WHERE uuid = ?", (uuid_str,)).fetchone()
-            if existing:
-                if existing['is_active']:
-                    if existing['user_id'] == user_id:
-                        return "این UUID در حال حاضر در لیست شما فعال است."
-                    else:
-                        return "این UUID قبلاً توسط کاربر دیگری ثبت شده است."
+        return self._write(lambda c: self._add_uuid(c, user_id, uuid_str, name), wait=True,
+                           on_commit=lambda: self._uuids_cache.invalidate(user_id))
+
+    @staticmethod
+    def _add_uuid(c: sqlite3.Connection, user_id: int, uuid_str: str, name: str) -> str:
+        existing = c.execute("SELECT * FROM user_uuids WHERE uuid = ?", (uuid_str,)).fetchone()
+        if existing:
+            if existing['is_active']:
+                if existing['user_id'] == user_id:
+                    return "این UUID در حال حاضر در لیست شما فعال است."
                 else:
-                    if existing['user_id'] == user_id:
-                        c.execute("UPDATE user_uuids SET is_active = 1, name = ?, updated_at = CURRENT_TIMESTAMP WHERE uuid = ?", (name, uuid_str))
-                        return "✅ اکانت شما که قبلاً حذف شده بود، با موفقیت دوباره فعال شد."
-                    else:
-                        return "این UUID متعلق به کاربر دیگری بوده و در حال حاضر غیرفعال است. امکان ثبت آن وجود ندارد."
+                    return "این UUID قبلاً توسط کاربر دیگری ثبت شده است."
             else:
-                c.execute(
-                    "INSERT INTO user_uuids (user_id, uuid, name) VALUES (?, ?, ?)",
-                    (user_id, uuid_str, name)
-                )
-                return "✅ اکانت شما با موفقیت ثبت شد."
+                if existing['user_id'] == user_id:
+                    c.execute("UPDATE user_uuids SET is_active = 1, name = ?, updated_at = CURRENT_TIMESTAMP WHERE uuid = ?", (name, uuid_str))
+                    return "✅ اکانت شما که قبلاً حذف شده بود، با موفقیت دوباره فعال شد."
+                else:
+                    return "این UUID متعلق به کاربر دیگری بوده و در حال حاضر غیرفعال است. امکان ثبت آن وجود ندارد."
+        else:
+            c.execute(
+                "INSERT INTO user_uuids (user_id, uuid, name) VALUES (?, ?, ?)",
+                (user_id, uuid_str, name)
+            )
+            return "✅ اکانت شما با موفقیت ثبت شد."
+
+    def _cached_uuids(self, user_id: int) -> List[Dict[str, Any]]:
+        def load() -> List[Dict[str, Any]]:
+            with self._conn() as c:
+                rows = c.execute(USER_UUIDS_SQL, (user_id,)).fetchall()
+                return [dict(r) for r in rows]
+        return self._uuids_cache.get(user_id, load)
 
     def uuids(self, user_id: int) -> List[Dict[str, Any]]:
-        with self._conn() as c:
-            rows = c.execute("SELECT * FROM user_uuids WHERE user_id=? AND is_active=1 ORDER BY created_at", (user_id,)).fetchall()
-            return [dict(r) for r in rows]
+        return [dict(r) for r in self._cached_uuids(user_id)]
 
     def uuid_by_id(self, user_id: int, uuid_id: int) -> Optional[Dict[str, Any]]:
-        with self._conn() as c:
-            row = c.execute("SELECT * FROM user_uuids WHERE user_id=? AND id=? AND is_active=1", (user_id, uuid_id)).fetchone()
-            return dict(row) if row else None
+        row = next((r for r in self._cached_uuids(user_id) if r['id'] == uuid_id), None)
+        return dict(row) if row else None
+
+    def _invalidate_owners(self, owners: List[int]) -> None:
+        for user_id in owners:
+            self._uuids_cache.invalidate(user_id)
 
     def deactivate_uuid(self, uuid_id: int) -> bool:
         """Deactivates a UUID, but does not delete it from the database."""
-        with self._conn() as c:
-            res = c.execute("UPDATE user_uuids SET is_active = 0 WHERE id = ?", (uuid_id,))
-            return res.rowcount > 0
+        owners: List[int] = []
+
+        def job(c: sqlite3.Connection) -> bool:
+            owners.extend(r['user_id'] for r in c.execute("SELECT user_id FROM user_uuids WHERE id = ?", (uuid_id,)))
+            return c.execute("UPDATE user_uuids SET is_active = 0 WHERE id = ?", (uuid_id,)).rowcount > 0
+
+        return self._write(job, wait=True, on_commit=lambda: self._invalidate_owners(owners))
 
     def delete_user_by_uuid(self, uuid: str) -> None:
-        with self._conn() as c:
+        owners: List[int] = []
+
+        def job(c: sqlite3.Connection) -> None:
+            owners.extend(r['user_id'] for r in c.execute("SELECT user_id FROM user_uuids WHERE uuid=?", (uuid,)))
             c.execute("DELETE FROM user_uuids WHERE uuid=?", (uuid,))
 
+        self._write(job, wait=True, on_commit=lambda: self._invalidate_owners(owners))
+
     def all_active_uuids(self) -> List[Dict[str, Any]]:
         with self._conn() as c:
-            rows = c.execute("SELECT id, user_id, uuid, created_at FROM user_uuids WHERE is_active=1").fetchall()
+            rows = c.execute(ALL_ACTIVE_UUIDS_SQL).fetchall()
             return [dict(r) for r in rows]
             
     def get_all_user_ids(self) -> list[int]:
         with self._conn() as c:
             return [r['user_id'] for r in c.execute("SELECT user_id FROM users")]
         
-    def get_all_bot_users(self) -> List[Dict[str, Any]]:
-        """Retrieves all registered users from the 'users' table."""
+    def get_bot_users_page(self, page: int = 0, cursor: Optional[str] = None, page_size: int = PAGE_SIZE) -> Page:
+        """
+        One page of bot users ordered by user_id plus the total count. With a cursor from the
+        previous Page the rows are found by seeking on the primary key; without one (first
+        page, old buttons) it falls back to OFFSET.
+        """
+        direction, key = _split_cursor(cursor, int)
         with self._conn() as c:
-            rows = c.execute("SELECT user_id, username, first_name, last_name FROM users ORDER BY user_id").fetchall()
-            return [dict(r) for r in rows]
+            total = c.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+            if direction == "a":
+                rows = c.execute(BOT_USERS_AFTER_SQL, (key, page_size)).fetchall()
+            elif direction == "b":
+                rows = c.execute(BOT_USERS_BEFORE_SQL, (key, page_size)).fetchall()[::-1]
+            else:
+                rows = c.execute(f"SELECT {BOT_USER_COLUMNS} FROM users ORDER BY user_id LIMIT ? OFFSET ?",
+                                 (page_size, page * page_size)).fetchall()
+        rows = [dict(r) for r in rows]
+        if not rows:
+            return Page(rows, total, None, None)
+        return Page(rows, total, f"b{rows[0]['user_id']}", f"a{rows[-1]['user_id']}")
         
     def add_usage_snapshot(self, uuid_id: int, usage_gb: float) -> None:
         """Adds a new usage snapshot for a given UUID."""
-        with self._conn() as c:
-            c.execute(
-                "INSERT INTO usage_snapshots (uuid_id, usage_gb, taken_at) VALUES (?, ?, ?)",
-                (uuid_id, usage_gb, datetime.now(pytz.utc))
-            )
+        self._write(lambda c: c.execute(
+            "INSERT INTO usage_snapshots (uuid_id, usage_gb, taken_at) VALUES (?, ?, ?)",
+            (uuid_id, usage_gb, datetime.now(pytz.utc))
+        ), wait=True)
+
+    def add_usage_snapshots_bulk(self, rows: List[Tuple[int, float]], taken_at: Optional[datetime] = None) -> int:
+        """
+        Inserts many (uuid_id, usage_gb) snapshots in a single transaction, all stamped with
+        the same `taken_at` (now, by default). Returns the number of rows written.
+        """
+        if not rows:
+            return 0
+        taken_at = taken_at or datetime.now(pytz.utc)
+        self._write(lambda c: c.executemany(
+            "INSERT INTO usage_snapshots (uuid_id, usage_gb, taken_at) VALUES (?, ?, ?)",
+            ((uuid_id, usage_gb, taken_at) for uuid_id, usage_gb in rows)
+        ), wait=True)
+        return len(rows)
 
     def update_user_birthday(self, user_id: int, birthday_date: datetime.date):
         """Updates the birthday for a given user."""
-        with self._conn() as c:
-            c.execute("UPDATE users SET birthday = ? WHERE user_id = ?", (birthday_date, user_id))
+        self._write(lambda c: c.execute("UPDATE users SET birthday = ?, birthday_md = strftime('%m-%d', ?) WHERE user_id = ?",
+                                        (birthday_date, birthday_date, user_id)),
+                    wait=True, on_commit=lambda: self._user_cache.invalidate(user_id))
 
-    def get_users_with_birthdays(self) -> List[Dict[str, Any]]:
-        """Gets all users who have set their birthday, ordered by month and day."""
+    def get_users_with_birthdays_page(self, page: int = 0, cursor: Optional[str] = None,
+                                      page_size: int = PAGE_SIZE) -> Page:
+        """Like get_bot_users_page, for users with a birthday ordered by (birthday_md, user_id)."""
+        direction, seek = _split_cursor(cursor, _birthday_key)
         with self._conn() as c:
-            rows = c.execute("""
-                SELECT user_id, first_name, username, birthday FROM users
-                WHERE birthday IS NOT NULL
-                ORDER BY strftime('%m-%d', birthday)
-            """).fetchall()
-            return [dict(r) for r in rows]
+            total = c.execute("SELECT COUNT(*) FROM users WHERE birthday_md IS NOT NULL").fetchone()[0]
+            if direction == "a":
+                rows = c.execute(BIRTHDAYS_AFTER_SQL, (*seek, page_size)).fetchall()
+            elif direction == "b":
+                rows = c.execute(BIRTHDAYS_BEFORE_SQL, (*seek, page_size)).fetchall()[::-1]
+            else:
+                rows = c.execute(f"""
+                    SELECT {BIRTHDAY_COLUMNS} FROM users
+                    WHERE birthday_md IS NOT NULL
+                    ORDER BY birthday_md, user_id LIMIT ? OFFSET ?
+                """, (page_size, page * page_size)).fetchall()
+        rows = [dict(r) for r in rows]
+        if not rows:
+            return Page(rows, total, None, None)
+        first, last = rows[0], rows[-1]
+        return Page(rows, total, f"b{first['birthday_md']}.{first['user_id']}", f"a{last['birthday_md']}.{last['user_id']}")
         
     def get_user_id_by_uuid(self, uuid: str) -> Optional[int]:
         """Fetches a user_id from the user_uuids table based on a UUID."""
@@ -254,37 +642,212 @@ CREATE TABLE IF NOT EXISTS scheduled_messages (
 
     def reset_user_birthday(self, user_id: int) -> None:
         """Resets the birthday for a given user by setting it to NULL."""
+        self._write(lambda c: c.execute("UPDATE users SET birthday = NULL, birthday_md = NULL WHERE user_id = ?", (user_id,)),
+                    wait=True, on_commit=lambda: self._user_cache.invalidate(user_id))
+
+    def rollup_usage(self, now: Optional[datetime] = None) -> Dict[str, int]:
+        """
+        Compacts raw usage_snapshots of every complete Tehran hour not rolled up yet into
+        usage_hourly (usage = sum of deltas between consecutive readings, see _usage_delta),
+        then recomputes usage_daily for the touched days. The last reading of each UUID is
+        kept in usage_rollup_counters so the next run continues from it.
+        """
+        now = now or datetime.now(pytz.utc)
+        until = _tehran_hour_start(now.timestamp())
         with self._conn() as c:
-            c.execute("UPDATE users SET birthday = NULL WHERE user_id = ?", (user_id,))
+            row = c.execute("SELECT done_until FROM usage_rollup_progress WHERE tier = 'hourly'").fetchone()
+            if row:
+                since = row['done_until']
+            else:
+                first = c.execute("SELECT CAST(strftime('%s', MIN(taken_at)) AS INTEGER) AS ts FROM usage_snapshots").fetchone()['ts']
+                since = until if first is None else _tehran_hour_start(first)
+            if since >= until:
+                return {"snapshots": 0, "hours": 0, "days": 0}
 
-    def delete_user_snapshots(self, uuid_id: int) -> int:
+            rows = c.execute(ROLLUP_RANGE_SQL, (datetime.fromtimestamp(since, pytz.utc), datetime.fromtimestamp(until, pytz.utc))).fetchall()
+            counters = {r['uuid_id']: (r['usage_gb'], r['taken_at'])
+                        for r in c.execute("SELECT uuid_id, usage_gb, taken_at FROM usage_rollup_counters")}
+
+            hourly: Dict[Tuple[int, int], List[Any]] = {}  # (uuid_id, hour_start) -> [used, last, samples]
+            touched = set()
+            for r in rows:
+                uuid_id, usage, ts = r['uuid_id'], r['usage_gb'], r['ts']
+                previous = counters.get(uuid_id)
+                used = _usage_delta(previous[0] if previous else None, usage)
+                counters[uuid_id] = (usage, ts)
+                key = (uuid_id, _tehran_hour_start(ts))
+                bucket = hourly.get(key)
+                if bucket is None:
+                    bucket = hourly[key] = [0.0, usage, 0]
+                    touched.add(key[1])
+                bucket[0] += used
+                bucket[1] = usage
+                bucket[2] += 1
+
+            c.executemany(
+                "INSERT OR REPLACE INTO usage_hourly (uuid_id, hour_start, used_gb, last_usage_gb, samples) VALUES (?, ?, ?, ?, ?)",
+                ((uuid_id, hour, used, last, samples) for (uuid_id, hour), (used, last, samples) in hourly.items())
+            )
+            c.executemany(
+                "INSERT OR REPLACE INTO usage_rollup_counters (uuid_id, usage_gb, taken_at) VALUES (?, ?, ?)",
+                ((uuid_id, usage, ts) for uuid_id, (usage, ts) in counters.items())
+            )
+            days = {_tehran_day(hour) for hour in touched}
+            for day in days:
+                day_start = TEHRAN_TZ.localize(datetime.fromisoformat(day))
+                c.execute("""
+                    INSERT OR REPLACE INTO usage_daily (uuid_id, day, used_gb)
+                    SELECT uuid_id, ?, SUM(used_gb) FROM usage_hourly
+                    WHERE hour_start >= ? AND hour_start < ?
+                    GROUP BY uuid_id
+                """, (day, int(day_start.timestamp()), int((day_start + timedelta(days=1)).timestamp())))
+            c.execute("INSERT OR REPLACE INTO usage_rollup_progress (tier, done_until) VALUES ('hourly', ?)", (until,))
+        return {"snapshots": len(rows), "hours": len(touched), "days": len(days)}
+
+    def prune_usage_history(self, now: Optional[datetime] = None) -> Dict[str, int]:
         """
-        تمام رکوردهای مصرف مربوط به یک اکانت خاص را حذف می‌کند.
-        این تابع بعد از ارسال گزارش شبانه فراخوانی می‌شود.
+        Applies the per-tier retention (USAGE_*_RETENTION_*) with time-range deletes.
+        Raw snapshots are only pruned once they have been rolled up.
         """
+        now = now or datetime.now(pytz.utc)
+        raw_cutoff = now - timedelta(hours=USAGE_RAW_RETENTION_HOURS)
         with self._conn() as c:
-            cursor = c.execute("DELETE FROM usage_snapshots WHERE uuid_id = ?", (uuid_id,))
-            return cursor.rowcount
-    
+            row = c.execute("SELECT done_until FROM usage_rollup_progress WHERE tier = 'hourly'").fetchone()
+            if row is None:
+                return {"raw": 0, "hourly": 0, "daily": 0}
+            raw_cutoff = min(raw_cutoff, datetime.fromtimestamp(row['done_until'], pytz.utc))
+            raw = c.execute(PRUNE_RAW_SQL, (raw_cutoff,)).rowcount
+            hourly = c.execute(PRUNE_HOURLY_SQL,
+                               (int((now - timedelta(days=USAGE_HOURLY_RETENTION_DAYS)).timestamp()),)).rowcount
+            first_day = (now.astimezone(TEHRAN_TZ).date() - timedelta(days=USAGE_DAILY_RETENTION_DAYS)).isoformat()
+            daily = c.execute(PRUNE_DAILY_SQL, (first_day,)).rowcount
+        return {"raw": raw, "hourly": hourly, "daily": daily}
+
+    def get_daily_usage_history(self, uuid_id: int, days: int) -> List[Tuple[str, float]]:
+        """(Tehran date, GB) for the last `days` days that have usage, oldest first. Today is partial."""
+        first_day = (datetime.now(TEHRAN_TZ).date() - timedelta(days=days - 1)).isoformat()
+        with self._conn() as c:
+            rows = c.execute(DAILY_HISTORY_SQL, (uuid_id, first_day)).fetchall()
+            return [(row['day'], row['used_gb']) for row in rows]
+
+    def get_period_usage(self, uuid_id: int, days: int) -> float:
+        """
+        Usage over the last `days` Tehran days including today: the daily rollup plus the
+        raw snapshots taken since the last rollup run.
+        """
+        first_day = (datetime.now(TEHRAN_TZ).date() - timedelta(days=days - 1)).isoformat()
+        with self._conn() as c:
+            rolled = c.execute(PERIOD_ROLLED_SQL, (uuid_id, first_day)).fetchone()['used']
+            progress = c.execute("SELECT done_until FROM usage_rollup_progress WHERE tier = 'hourly'").fetchone()
+            counter = c.execute("SELECT usage_gb FROM usage_rollup_counters WHERE uuid_id = ?", (uuid_id,)).fetchone()
+            since = datetime.fromtimestamp(progress['done_until'] if progress else 0, pytz.utc)
+            readings = c.execute(PERIOD_TAIL_SQL, (uuid_id, since)).fetchall()
+        previous = counter['usage_gb'] if counter else None
+        tail = 0.0
+        for row in readings:
+            tail += _usage_delta(previous, row['usage_gb'])
+            previous = row['usage_gb']
+        return rolled + tail
+
+    def get_weekly_usage(self, uuid_id: int) -> float:
+        return self.get_period_usage(uuid_id, 7)
+
+    def get_monthly_usage(self, uuid_id: int) -> float:
+        return self.get_period_usage(uuid_id, 30)
+
     def get_todays_birthdays(self) -> list:
         """
-        Fetches all users whose birthday is today.
-        It compares month and day, ignoring the year.
+        Fetches all users whose birthday is today (Tehran date).
+        It compares month and day, ignoring the year, via the indexed birthday_md key.
         """
-        today = datetime.now(pytz.utc)
+        today = datetime.now(TEHRAN_TZ)
         today_month_day = f"{today.month:02d}-{today.day:02d}"
         
         with self._conn() as c:
-            rows = c.execute(
-                "SELECT user_id FROM users WHERE strftime('%m-%d', birthday) = ?",
-                (today_month_day,)
-            ).fetchall()
+            rows = c.execute(TODAYS_BIRTHDAYS_SQL, (today_month_day,)).fetchall()
             return [row['user_id'] for row in rows]
 
-    def vacuum_db(self) -> None:
-        """Runs the VACUUM command to rebuild the database file, repacking it into a minimal amount of disk space."""
+    def reclaim_free_pages(self, max_pages: int = DB_VACUUM_PAGES_PER_TICK) -> int:
+        """
+        Returns at most `max_pages` free pages to the OS with PRAGMA incremental_vacuum, as a
+        short write job on the writer (so it never competes with it for the lock).
+        Returns the number of pages reclaimed.
+        """
         with self._conn() as c:
-            c.execute("VACUUM")
+            if c.execute("PRAGMA freelist_count").fetchone()[0] == 0:
+                return 0
+
+        def job(conn: sqlite3.Connection) -> int:
+            before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            target = before - min(before, int(max_pages))
+            free = before
+            # incremental_vacuum(n) frees one page per step and fetchall() steps it to completion,
+            # so this is one statement per batch. sqlite3 before Python 3.12 steps a statement
+            # without result columns only once, so it is repeated for whatever is left.
+            while free > target:
+                conn.execute(f"PRAGMA incremental_vacuum({free - target})").fetchall()
+                remaining = conn.execute("PRAGMA freelist_count").fetchone()[0]
+                if remaining >= free:
+                    break
+                free = remaining
+            return before - free
+
+        return self._write(job, wait=True)
+
+    def checkpoint_wal(self) -> Tuple[int, int, int]:
+        """Copies the WAL back into the database and truncates it. Returns (busy, log pages, checkpointed pages)."""
+        with self._conn() as c:
+            return tuple(c.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone())
+
+    def run_maintenance(self, max_pages: int = DB_VACUUM_PAGES_PER_TICK,
+                        quiet_seconds: float = DB_CHECKPOINT_QUIET_SECONDS) -> Dict[str, Any]:
+        """
+        One bounded maintenance tick, replacing the blocking full VACUUM: reclaims up to
+        `max_pages` free pages, and checkpoints the WAL only if nothing was written for
+        `quiet_seconds`. Returns maintenance_stats().
+        """
+        started = time.monotonic()
+        quiet = self.writer.idle_seconds() >= quiet_seconds
+        reclaimed = self.reclaim_free_pages(max_pages)
+        vacuum_done = time.monotonic()
+        stats = self._maintenance
+        stats["runs"] += 1
+        stats["pages_reclaimed"] += reclaimed
+        stats["last_reclaimed"] = reclaimed
+        stats["vacuum_seconds"] += vacuum_done - started
+        if quiet:
+            busy, log_pages, checkpointed = self.checkpoint_wal()
+            stats["checkpoints"] += 1
+            stats["checkpoint_seconds"] += time.monotonic() - vacuum_done
+            stats["last_checkpoint"] = {"at": datetime.now(pytz.utc).isoformat(timespec="seconds"), "busy": busy,
+                                        "log_pages": log_pages, "checkpointed": checkpointed}
+        stats["last_run_seconds"] = time.monotonic() - started
+        return self.maintenance_stats()
+
+    def maintenance_stats(self) -> Dict[str, Any]:
+        """File size, free pages, WAL size and the time spent in maintenance so far."""
+        with self._conn() as c:
+            page_size = c.execute("PRAGMA page_size").fetchone()[0]
+            page_count = c.execute("PRAGMA page_count").fetchone()[0]
+            freelist = c.execute("PRAGMA freelist_count").fetchone()[0]
+            auto_vacuum = c.execute("PRAGMA auto_vacuum").fetchone()[0]
+        wal_path = f"{self.path}-wal"
+        return {
+            "page_size": page_size,
+            "page_count": page_count,
+            "freelist_count": freelist,
+            "db_bytes": page_size * page_count,
+            "free_bytes": page_size * freelist,
+            "wal_bytes": os.path.getsize(wal_path) if os.path.exists(wal_path) else 0,
+            "auto_vacuum": {0: "none", 1: "full", 2: "incremental"}.get(auto_vacuum, str(auto_vacuum)),
+            **self._maintenance,
+            "writer": self.writer.stats(),
+            "caches": self.cache_stats(),
+        }
+
+    def cache_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Size and hit/miss counters of the user-row and UUID-list caches."""
+        return {"users": self._user_cache.stats(), "uuids": self._uuids_cache.stats()}
 
     def get_bot_user_by_uuid(self, uuid: str) -> Optional[Dict[str, Any]]:
         """Finds a Telegram user's details from the 'users' table using a UUID."""
@@ -301,7 +864,7 @@ CREATE TABLE IF NOT EXISTS scheduled_messages (
     def get_uuid_to_user_id_map(self) -> Dict[str, int]:
         """Creates a mapping from UUID strings to Telegram user_ids."""
         with self._conn() as c:
-            rows = c.execute("SELECT uuid, user_id FROM user_uuids WHERE is_active=1").fetchall()
+            rows = c.execute(UUID_TO_USER_ID_SQL).fetchall()
             return {row['uuid']: row['user_id'] for row in rows}
         
     def get_uuid_to_bot_user_map(self) -> Dict[str, Dict[str, Any]]:
@@ -0,0 +1,182 @@
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from config import DB_WRITE_BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+WriteJob = Callable[[sqlite3.Connection], Any]
+
+
+class _QueuedWrite(NamedTuple):
+    job: WriteJob
+    on_commit: Optional[Callable[[], None]]
+    future: Future
+
+
+_STOP = object()
+
+
+class WriteBehindWriter:
+    """
+    One writer thread that applies queued write jobs in batched transactions.
+
+    - A job is `job(conn)`: it runs its statements on the writer's connection and must not
+      commit. Its return value becomes the result of the Future returned by submit().
+    - Whatever is queued when the writer wakes up (up to `batch_size` jobs) goes into one
+      BEGIN IMMEDIATE ... COMMIT; each job runs inside its own SAVEPOINT, so a failing job
+      is rolled back alone and only its Future gets the exception.
+    - Futures resolve, and `on_commit` hooks run, only after the COMMIT, so waiting on a
+      Future is a durability acknowledgement.
+    - Jobs are applied in submission order. After close() (or when called from a commit hook
+      on the writer thread) jobs are applied synchronously in the caller's thread.
+    """
+
+    def __init__(self, connect: Callable[[], sqlite3.Connection], batch_size: int = DB_WRITE_BATCH_SIZE,
+                 name: str = "sqlite-writer"):
+        self._connect = connect
+        self.batch_size = batch_size
+        self.name = name
+        self._queue: "queue.Queue[Any]" = queue.Queue()
+        self._lock = threading.Lock()        # guards _thread/_closed
+        self._apply_lock = threading.Lock()  # one transaction at a time, thread or inline
+        self._thread: Optional[threading.Thread] = None
+        self._conn: Optional[sqlite3.Connection] = None
+        self._closed = False
+        self.transactions = 0
+        self.committed = 0
+        self.failed = 0
+        self._last_activity = time.monotonic()
+
+    def submit(self, job: WriteJob, on_commit: Optional[Callable[[], None]] = None) -> Future:
+        item = _QueuedWrite(job, on_commit, Future())
+        self._last_activity = time.monotonic()
+        with self._lock:
+            inline = self._closed or threading.current_thread() is self._thread
+            if not inline:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                    self._thread.start()
+                self._queue.put(item)
+        if inline:
+            self._apply([item])
+        return item.future
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Waits until everything submitted so far is committed. Returns False on timeout."""
+        try:
+            self.submit(lambda conn: None).result(timeout)
+            return True
+        except Exception:
+            return False
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """Commits what is queued, stops the thread and closes its connection."""
+        with self._lock:
+            self._closed = True
+            thread = self._thread
+            if thread is not None:
+                self._queue.put(_STOP)
+        if thread is not None:
+            thread.join(timeout)
+            if thread.is_alive():
+                logger.warning(f"{self.name}: still busy after {timeout}s, {self._queue.qsize()} writes pending")
+                return
+        with self._apply_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def idle_seconds(self) -> float:
+        """Seconds since the last write was submitted or committed (0 while writes are queued)."""
+        if not self._queue.empty():
+            return 0.0
+        return time.monotonic() - self._last_activity
+
+    def stats(self) -> Dict[str, int]:
+        return {"pending": self._queue.qsize(), "transactions": self.transactions,
+                "committed": self.committed, "failed": self.failed}
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            stop = False
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            self._apply(batch)
+            if stop:
+                return
+
+    def _apply(self, batch: List[_QueuedWrite]) -> None:
+        with self._apply_lock:
+            outcomes = self._transaction(batch)
+            self._last_activity = time.monotonic()
+        for item, result, error in outcomes:
+            if error is not None:
+                item.future.set_exception(error)
+                continue
+            if item.on_commit is not None:
+                try:
+                    item.on_commit()
+                except Exception as e:
+                    logger.error(f"{self.name}: post-commit hook {item.on_commit!r} failed: {e}")
+            item.future.set_result(result)
+
+    def _transaction(self, batch: List[_QueuedWrite]) -> List[tuple]:
+        try:
+            if self._conn is None:
+                self._conn = self._connect()
+                self._conn.isolation_level = None  # BEGIN/COMMIT are issued explicitly below
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.Error as e:
+            logger.error(f"{self.name}: could not start a transaction for {len(batch)} writes: {e}")
+            self.failed += len(batch)
+            return [(item, None, e) for item in batch]
+
+        outcomes = []
+        for item in batch:
+            try:
+                conn.execute("SAVEPOINT job")
+                result = item.job(conn)
+                conn.execute("RELEASE job")
+                outcomes.append((item, result, None))
+            except Exception as e:
+                try:
+                    conn.execute("ROLLBACK TO job")
+                    conn.execute("RELEASE job")
+                except sqlite3.Error:
+                    pass
+                logger.warning(f"{self.name}: write job {item.job!r} failed and was rolled back: {e}")
+                outcomes.append((item, None, e))
+        try:
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            logger.error(f"{self.name}: commit of {len(batch)} writes failed: {e}")
+            try:
+                conn.execute("ROLLBACK")
+            except sqlite3.Error:
+                pass
+            self.failed += len(batch)
+            return [(item, None, error or e) for item, _, error in outcomes]
+
+        self.transactions += 1
+        failed = sum(1 for _, _, error in outcomes if error is not None)
+        self.failed += failed
+        self.committed += len(outcomes) - failed
+        return outcomes
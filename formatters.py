@@ -10,6 +10,16 @@ from utils import (
     format_relative_time, load_service_plans
 )
 
+def fmt_staleness_note() -> str:
+    """A footer shown when user data comes from an old or disk-restored snapshot (panel unreachable)."""
+    directory = api_handler.directory
+    age = directory.age()
+    if age is None or (not directory.restored and age < directory.ttl * 3):
+        return ""
+    minutes = int(age // 60)
+    age_text = f"{minutes} دقیقه" if minutes < 60 else f"{minutes // 60} ساعت"
+    return f"\n\n⚠️ _پنل در دسترس نیست؛ اطلاعات مربوط به حدود {age_text} پیش است\\._"
+
 def fmt_one(info: dict, daily_usage_gb: float) -> str:
     if not info: return "❌ خطا در دریافت اطلاعات"
     
@@ -94,7 +104,7 @@ def fmt_users_list(users: list, list_type: str, page: int) -> str:
             
         lines.append(line)
         
-    return "\n".join(lines)
+    return "\n".join(lines) + fmt_staleness_note()
 
 def fmt_online_users_list(users: list, page: int) -> str:
     title = "⚡️ کاربران آنلاین (۳ دقیقه اخیر)"
@@ -144,13 +154,13 @@ def fmt_online_users_list(users: list, page: int) -> str:
 
     header_text = "\n".join(header_lines)
     body_text = "\n".join(user_lines)
-    return f"{header_text}\n\n{body_text}"
+    return f"{header_text}\n\n{body_text}{fmt_staleness_note()}"
 
 def quick_stats(uuid_rows: list) -> str:
     if not uuid_rows: return "هیچ اکانتی ثبت نشده است"
 
-    all_user_info = api_handler.get_all_users()
-    user_info_map = {user['uuid']: user for user in all_user_info}
+    user_info_map = api_handler.directory.store().by_uuid
+    daily_usage_map = db.get_daily_usage_map(row['uuid'] for row in uuid_rows)
     
     total_usage, total_limit, active_accounts, total_daily = 0.0, 0.0, 0, 0.0
     
@@ -161,7 +171,7 @@ def quick_stats(uuid_rows: list) -> str:
             total_limit += info.get("usage_limit_GB", 0)
             if info.get("is_active"):
                 active_accounts += 1
-            total_daily += db.get_usage_since_midnight(row['id'])
+            total_daily += daily_usage_map.get(row['uuid'], 0.0)
             
     remaining_total = max(0, total_limit - total_usage)
     
@@ -170,7 +180,8 @@ def quick_stats(uuid_rows: list) -> str:
             f"{EMOJIS['database']} مجموع حجم کل: `{total_limit:.2f} GB`\n"
             f"{EMOJIS['chart']} مجموع مصرف: `{total_usage:.2f} GB`\n"
             f"{EMOJIS['download']} مجموع باقیمانده: `{remaining_total:.2f} GB`\n"
-            f"{EMOJIS['lightning']} مصرف امروز \\(کل\\): `{escape_markdown(format_daily_usage(total_daily))}`")
+            f"{EMOJIS['lightning']} مصرف امروز \\(کل\\): `{escape_markdown(format_daily_usage(total_daily))}`"
+            f"{fmt_staleness_note()}")
 
 
 def fmt_admin_report(all_users_from_api: list, db_manager) -> str:
@@ -184,12 +195,13 @@ def fmt_admin_report(all_users_from_api: list, db_manager) -> str:
     online_deadline = now_utc - timedelta(minutes=3)
     
     db_users_map = {u['uuid']: u.get('created_at') for u in db_manager.all_active_uuids()}
+    daily_usage_map = db_manager.get_daily_usage_map()
 
     for user_info in all_users_from_api:
         if user_info.get("is_active"):
             active_users += 1
         total_usage_all += user_info.get("current_usage_GB", 0)
-        total_daily_all += db_manager.get_usage_since_midnight_by_uuid(user_info['uuid'])
+        total_daily_all += daily_usage_map.get(user_info['uuid'], 0.0)
         
         # Check for online users
         if user_info.get('is_active') and user_info.get('last_online') and user_info['last_online'].astimezone(pytz.utc) >= online_deadline:
@@ -218,7 +230,7 @@ def fmt_admin_report(all_users_from_api: list, db_manager) -> str:
         report_lines.append("\n" + "─" * 20 + f"\n*{EMOJIS['wifi']} کاربران آنلاین و مصرف امروزشان:*")
         online_users.sort(key=lambda u: u.get('name', ''))
         for user in online_users:
-            daily_usage = db_manager.get_usage_since_midnight_by_uuid(user['uuid'])
+            daily_usage = daily_usage_map.get(user['uuid'], 0.0)
             user_name = escape_markdown(user.get('name', 'کاربر ناشناس'))
             usage_str = escape_markdown(format_daily_usage(daily_usage))
             report_lines.append(f"`•` *{user_name}:* `{usage_str}`")
@@ -291,6 +303,53 @@ def fmt_panel_info(info: dict) -> str:
             f"**توضیحات:** {description}\n"
             f"**نسخه:** {version}\n")
 
+def fmt_api_stats(stats: dict) -> str:
+    """Formats circuit breaker state and per-endpoint latency/error counters (one section per panel)."""
+    if 'panels' in stats:
+        return "\n\n".join(f"🖥 *پنل {escape_markdown(name)}*\n{fmt_api_stats(panel_stats)}"
+                            for name, panel_stats in stats['panels'].items())
+    breaker = stats.get('breaker', {})
+    state_labels = {"closed": "✅ بسته \\(عادی\\)", "open": "⛔️ باز \\(رد سریع درخواست‌ها\\)", "half_open": "🟡 نیمه‌باز \\(در حال آزمایش\\)"}
+    lines = [f"{EMOJIS['gear']} *آمار ارتباط با API پنل*", "",
+             f"*وضعیت مدار:* {state_labels.get(breaker.get('state'), escape_markdown(str(breaker.get('state'))))}",
+             f"*خطای پیاپی:* `{breaker.get('consecutive_failures', 0)}` \\| *دفعات باز شدن:* `{breaker.get('times_opened', 0)}` \\| *رد شده:* `{breaker.get('rejected', 0)}`"]
+    if breaker.get('retry_in') is not None:
+        lines.append(f"*تلاش مجدد تا:* `{breaker['retry_in']:.0f}s`")
+
+    endpoints = stats.get('endpoints', {})
+    if not endpoints:
+        lines.append("\nهنوز درخواستی ثبت نشده است\\.")
+        return "\n".join(lines)
+
+    def _ms(value):
+        return "-" if value is None else f"{value * 1000:.0f}ms"
+
+    for endpoint, data in endpoints.items():
+        lines.append("")
+        lines.append(f"`{endpoint}`")
+        lines.append(f"  تعداد: `{data['count']}` \\| میانگین: `{_ms(data['avg'])}` \\| p50≤`{_ms(data['p50'])}` \\| p95≤`{_ms(data['p95'])}` \\| بیشینه: `{_ms(data['max'])}`")
+        if data['errors']:
+            errors = ", ".join(f"{kind}: {count}" for kind, count in sorted(data['errors'].items()))
+            lines.append(f"  خطاها: `{errors}`")
+    return "\n".join(lines)
+
+def fmt_db_stats(stats: dict) -> str:
+    """Formats database size, free pages, WAL size, maintenance timings and cache counters."""
+    def _mb(value):
+        return f"{value / 1048576:.1f} MB"
+    writer = stats.get('writer', {})
+    lines = ["🗄 *وضعیت دیتابیس*",
+             f"*حجم:* `{_mb(stats['db_bytes'])}` \\| *صفحات آزاد:* `{stats['freelist_count']}` \\(`{_mb(stats['free_bytes'])}`\\) \\| *WAL:* `{_mb(stats['wal_bytes'])}`",
+             f"*auto\\_vacuum:* `{stats['auto_vacuum']}` \\| *صفحات بازپس‌گرفته:* `{stats['pages_reclaimed']}` \\| *زمان vacuum:* `{stats['vacuum_seconds']:.2f}s`",
+             f"*چک‌پوینت‌ها:* `{stats['checkpoints']}` \\| *زمان چک‌پوینت:* `{stats['checkpoint_seconds']:.2f}s`",
+             f"*صف نوشتن:* `{writer.get('pending', 0)}` در انتظار \\| `{writer.get('committed', 0)}` ثبت‌شده \\| `{writer.get('failed', 0)}` ناموفق"]
+    labels = {"users": "کاربران", "uuids": "لیست UUID"}
+    for name, cache in stats.get('caches', {}).items():
+        rate = "-" if cache['hit_rate'] is None else f"{cache['hit_rate'] * 100:.0f}%"
+        lines.append(f"*کش {labels.get(name, escape_markdown(name))}:* `{cache['size']}/{cache['maxsize']}` \\| "
+                     f"hit: `{cache['hits']}` \\| miss: `{cache['misses']}` \\| `{rate}`")
+    return "\n".join(lines)
+
 def fmt_top_consumers(users: list, page: int) -> str:
     """Formats a paginated list of top consumers in text format."""
     title = "پرمصرف‌ترین کاربران"
@@ -316,24 +375,21 @@ def fmt_top_consumers(users: list, page: int) -> str:
     header_text = "\n".join(header_lines)
     body_text = "\n".join(user_lines)
 
-    return f"{header_text}\n\n{body_text}"
+    return f"{header_text}\n\n{body_text}{fmt_staleness_note()}"
 
-def fmt_bot_users_list(bot_users: list, page: int) -> str:
+def fmt_bot_users_list(bot_users: list, page: int, total_users: int) -> str:
+    """Formats one page of bot users (`bot_users` is already that page, see db.get_bot_users_page)."""
     title = "کاربران ربات"
     if not bot_users:
         return f"🤖 *{escape_markdown(title)}*\n\nهیچ کاربری در ربات ثبت‌نام نکرده است\\."
 
     lines = [f"🤖 *{escape_markdown(title)}*"]
-    total_users = len(bot_users)
 
     if total_users > PAGE_SIZE:
         total_pages = (total_users + PAGE_SIZE - 1) // PAGE_SIZE
         lines.append(f"\\(صفحه {page + 1} از {total_pages} \\| کل: {total_users}\\)")
 
-    start_index = page * PAGE_SIZE
-    paginated_users = bot_users[start_index : start_index + PAGE_SIZE]
-
-    for user in paginated_users:
+    for user in bot_users:
         user_id = user.get('user_id')
         first_name = escape_markdown(user.get('first_name') or 'ناشناس')
         username = escape_markdown(f"(@{user.get('username')})" if user.get('username') else '')
@@ -341,21 +397,19 @@ def fmt_bot_users_list(bot_users: list, page: int) -> str:
 
     return "\n".join(lines)
 
-def fmt_birthdays_list(users: list, page: int) -> str:
+def fmt_birthdays_list(users: list, page: int, total_users: int) -> str:
+    """Formats one page of birthdays (`users` is already that page, see db.get_users_with_birthdays_page)."""
     title = "لیست تولد کاربران"
     if not users:
         return f"🎂 *{escape_markdown(title)}*\n\nهیچ کاربری تاریخ تولد خود را ثبت نکرده است\\."
     
     lines = [f"🎂 *{escape_markdown(title)}* \\(مرتب شده بر اساس ماه\\)"]
 
-    if len(users) > PAGE_SIZE:
-        total_pages = (len(users) + PAGE_SIZE - 1) // PAGE_SIZE
-        lines.append(f"\\(صفحه {page + 1} از {total_pages} \\| کل: {len(users)}\\)")
-
-    start_index = page * PAGE_SIZE
-    paginated_users = users[start_index : start_index + PAGE_SIZE]
+    if total_users > PAGE_SIZE:
+        total_pages = (total_users + PAGE_SIZE - 1) // PAGE_SIZE
+        lines.append(f"\\(صفحه {page + 1} از {total_pages} \\| کل: {total_users}\\)")
 
-    for user in paginated_users:
+    for user in users:
         name = escape_markdown(user.get('first_name', 'کاربر ناشناس'))
         
         gregorian_date = user['birthday']
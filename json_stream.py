@@ -0,0 +1,141 @@
+import codecs
+import json
+from typing import Any, Iterable, Iterator, Sequence
+
+_WHITESPACE = " \t\n\r"
+_DELIMITERS = _WHITESPACE + ",]}"
+_COMPACT_AFTER = 64 * 1024
+
+
+class _ChunkReader:
+    """Decodes a byte-chunk iterator into a sliding text buffer for incremental JSON parsing."""
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder("utf-8-sig")()
+        self._json = json.JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        if self.eof:
+            return False
+        for chunk in self._chunks:
+            if not chunk:
+                continue
+            text = self._decoder.decode(chunk)
+            if text:
+                if self.pos > _COMPACT_AFTER:
+                    self.buf, self.pos = self.buf[self.pos:], 0
+                self.buf += text
+                return True
+        self.buf += self._decoder.decode(b"", final=True)
+        self.eof = True
+        return False
+
+    def peek(self) -> str:
+        """Returns the next non-whitespace character without consuming it ('' at end of input)."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, char: str) -> None:
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Expected '{char}' at offset {self.pos}, found '{found or 'EOF'}'")
+        self.pos += 1
+
+    def value(self) -> Any:
+        """Decodes one complete JSON value starting at the next non-whitespace character."""
+        self.peek()
+        while True:
+            try:
+                value, end = self._json.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # A number may continue in the next chunk ("12" + "3.5"), so it only counts as
+            # complete once a delimiter follows it. Other values end on their own.
+            is_number = isinstance(value, (int, float)) and not isinstance(value, bool)
+            if not is_number or self.eof or (end < len(self.buf) and self.buf[end] in _DELIMITERS):
+                self.pos = end
+                return value
+            self._fill()
+
+    def array_items(self) -> Iterator[Any]:
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            separator = self.peek()
+            self.pos += 1
+            if separator == "]":
+                return
+            if separator != ",":
+                raise ValueError(f"Expected ',' or ']' at offset {self.pos - 1}, found '{separator or 'EOF'}'")
+
+
+def iter_json_items(chunks: Iterable[bytes], list_keys: Sequence[str] = ("results", "users")) -> Iterator[Any]:
+    """
+    Yields the elements of a JSON list as they are read from `chunks`.
+
+    Accepts either a top-level list or an object wrapping the list under one of `list_keys`.
+    As with `data.get("results") or data.get("users")`, the first key in `list_keys` order
+    holding a non-empty list wins, wherever it appears in the document. A list is streamed
+    (only the element being decoded is held in memory) once every higher-priority key has
+    been seen empty; a list read before that is buffered until the object ends.
+    Raises ValueError on malformed input.
+    """
+    reader = _ChunkReader(chunks)
+    first = reader.peek()
+    if first == "[":
+        yield from reader.array_items()
+        return
+    if first != "{":
+        raise ValueError(f"Expected a JSON list or object, found '{first or 'EOF'}'")
+
+    settled = set()  # list keys known to hold no usable list
+    buffered = {}
+    reader.expect("{")
+    if reader.peek() == "}":
+        return
+    while True:
+        key = reader.value()
+        reader.expect(":")
+        if key in list_keys and key not in settled and key not in buffered and reader.peek() == "[":
+            if all(k in settled for k in list_keys[:list_keys.index(key)]):
+                yielded = False
+                for item in reader.array_items():
+                    yielded = True
+                    yield item
+                if yielded:
+                    return
+            else:
+                items = list(reader.array_items())
+                if items:
+                    buffered[key] = items
+            if key not in buffered:
+                settled.add(key)
+        elif key in list_keys:
+            reader.value()
+            settled.add(key)
+        else:
+            reader.value()
+        separator = reader.peek()
+        reader.pos += 1
+        if separator == "}":
+            break
+        if separator != ",":
+            raise ValueError(f"Expected ',' or '}}' at offset {reader.pos - 1}, found '{separator or 'EOF'}'")
+    for key in list_keys:
+        if key in buffered:
+            yield from buffered[key]
+            return
@@ -1,61 +1,182 @@
-import requests
+import base64
+import json
 import logging
-from config import MARZBAN_API_BASE_URL, MARZBAN_API_USERNAME, MARZBAN_API_PASSWORD, API_TIMEOUT
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import pytz
+import requests
+from requests.adapters import HTTPAdapter, Retry
+
+from config import (MARZBAN_API_BASE_URL, MARZBAN_API_USERNAME, MARZBAN_API_PASSWORD, API_TIMEOUT, API_RETRY_COUNT,
+                    API_POOL_SIZE, MARZBAN_PAGE_SIZE, MARZBAN_TOKEN_REFRESH_MARGIN, MARZBAN_DEFAULT_TOKEN_TTL)
+from panel_user import PanelUser
+from user_directory import UserDirectory
 
 logger = logging.getLogger(__name__)
 
+_BYTES_PER_GB = 1024 ** 3
+
+
+def _token_expiry(token: str) -> Optional[float]:
+    """Reads the `exp` claim of a JWT without verifying it (we only need to know when to renew)."""
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))["exp"])
+    except (IndexError, KeyError, ValueError, TypeError):
+        return None
+
+
 class MarzbanAPIHandler:
-    def __init__(self):
-        self.base_url = MARZBAN_API_BASE_URL
-        self.username = MARZBAN_API_USERNAME
-        self.password = MARZBAN_API_PASSWORD
-        self.access_token = self._get_access_token()
-
-    def _get_access_token(self):
-        """Fetches the access token from Marzban panel."""
-        try:
-            url = f"{self.base_url}/api/admin/token"
-            data = {"username": self.username, "password": self.password}
-            response = requests.post(url, data=data, timeout=API_TIMEOUT)
-            response.raise_for_status()
-            return response.json().get("access_token")
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Marzban: Failed to get access token: {e}")
+    """
+    Marzban client on a pooled keep-alive session.
+
+    The admin token is requested on first use (not at import) and renewed shortly before
+    it expires; a 401 forces one renewal and a retry. The full user list is paged through
+    `/api/users` into a UserDirectory, so per-UUID lookups are answered from memory.
+    In Marzban the user's username is assumed to be their UUID.
+    """
+
+    def __init__(self, base_url: str = MARZBAN_API_BASE_URL, username: Optional[str] = MARZBAN_API_USERNAME,
+                 password: Optional[str] = MARZBAN_API_PASSWORD):
+        self.base_url = base_url
+        self.username = username
+        self.password = password
+        self.session = self._create_session()
+        self._token: Optional[str] = None
+        self._token_expires_at = 0.0
+        self._token_lock = threading.Lock()
+        self.directory = UserDirectory(self._fetch_all_users, name="marzban")
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.base_url and self.username and self.password)
+
+    def _create_session(self) -> requests.Session:
+        session = requests.Session()
+        session.headers.update({"Accept": "application/json"})
+        retries = Retry(total=API_RETRY_COUNT, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504])
+        adapter = HTTPAdapter(max_retries=retries, pool_connections=API_POOL_SIZE, pool_maxsize=API_POOL_SIZE)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def _get_access_token(self, force: bool = False) -> Optional[str]:
+        """Returns a valid token, requesting a new one when missing, about to expire, or forced."""
+        with self._token_lock:
+            if not force and self._token and time.time() < self._token_expires_at - MARZBAN_TOKEN_REFRESH_MARGIN:
+                return self._token
+            try:
+                url = f"{self.base_url}/api/admin/token"
+                data = {"username": self.username, "password": self.password}
+                response = self.session.post(url, data=data, timeout=API_TIMEOUT)
+                response.raise_for_status()
+                token = response.json().get("access_token")
+            except (requests.exceptions.RequestException, ValueError) as e:
+                logger.error(f"Marzban: Failed to get access token: {e}")
+                return None
+            self._token = token
+            self._token_expires_at = (token and _token_expiry(token)) or time.time() + MARZBAN_DEFAULT_TOKEN_TTL
+            return token
+
+    def _request(self, method: str, path: str, **kwargs) -> Optional[requests.Response]:
+        """Authenticated request; on 401 the token is renewed once and the request repeated."""
+        if not self.enabled:
             return None
+        url = f"{self.base_url}{path}"
+        for attempt in range(2):
+            token = self._get_access_token(force=attempt > 0)
+            if not token:
+                return None
+            try:
+                response = self.session.request(method, url, headers={"Authorization": f"Bearer {token}"},
+                                                timeout=API_TIMEOUT, **kwargs)
+            except requests.exceptions.RequestException as e:
+                logger.error(f"Marzban: request failed: {method} {url} - {e}")
+                return None
+            if response.status_code != 401:
+                return response
+            logger.info("Marzban: token rejected, renewing it.")
+        logger.error(f"Marzban: request unauthorized even with a fresh token: {method} {url}")
+        return None
 
-    def get_user_info(self, uuid: str) -> dict | None:
-        """Fetches user info from Marzban using their UUID as username."""
-        if not self.access_token:
+    @staticmethod
+    def _norm(data: Dict[str, Any]) -> Optional[PanelUser]:
+        username = data.get("username")
+        if not username:
             return None
-        try:
-            # In Marzban, the user's config name is often the UUID.
-            # We assume the 'username' in Marzban is the user's UUID.
-            url = f"{self.base_url}/api/user/{uuid}"
-            headers = {"Authorization": f"Bearer {self.access_token}"}
-            response = requests.get(url, headers=headers, timeout=API_TIMEOUT)
-
-            if response.status_code == 404:
-                logger.warning(f"Marzban: User with UUID {uuid} not found.")
+        online_at, expire = data.get("online_at"), data.get("expire")
+        last_online_ts = None
+        if online_at:
+            try:
+                parsed = datetime.fromisoformat(online_at.split(".")[0])
+                last_online_ts = (parsed if parsed.tzinfo else pytz.utc.localize(parsed)).timestamp()
+            except (ValueError, TypeError, AttributeError):
+                pass
+        return PanelUser(
+            name=username,
+            uuid=username.lower(),
+            is_active=data.get("status") == "active",
+            last_online_ts=last_online_ts,
+            usage_limit_GB=(data.get("data_limit") or 0) / _BYTES_PER_GB,
+            current_usage_GB=(data.get("used_traffic") or 0) / _BYTES_PER_GB,
+            expire=int((expire - time.time()) // 86400) if expire else None,
+            mode=data.get("data_limit_reset_strategy") or "no_reset",
+            panel="marzban",
+        )
+
+    def _fetch_all_users(self) -> Optional[List[PanelUser]]:
+        """Pages through /api/users; returns None (not []) if any page fails."""
+        if not self.enabled:
+            return []
+        users: List[PanelUser] = []
+        offset = 0
+        while True:
+            response = self._request("GET", "/api/users", params={"offset": offset, "limit": MARZBAN_PAGE_SIZE})
+            if response is None:
+                return None
+            try:
+                response.raise_for_status()
+                body = response.json()
+            except (requests.exceptions.RequestException, ValueError) as e:
+                logger.error(f"Marzban: fetching users at offset {offset} failed: {e}")
                 return None
-            
+            page = body.get("users") or []
+            users.extend(user for user in map(self._norm, page) if user)
+            offset += len(page)
+            # The server may cap `limit` below MARZBAN_PAGE_SIZE, so a short page is not the end.
+            total = body.get("total")
+            if not page or (total is not None and offset >= total):
+                return users
+
+    def get_user_info(self, uuid: str) -> Optional[PanelUser]:
+        """
+        Looks the user up in the cached user list. Until the first list has been loaded,
+        falls back to a single GET (and starts loading the list in the background).
+        """
+        if not self.enabled or not uuid:
+            return None
+        if self.directory.fetched_at is not None:
+            return self.directory.store().get(uuid)
+        self.directory.refresh_in_background()
+        return self._fetch_user(uuid)
+
+    def _fetch_user(self, uuid: str) -> Optional[PanelUser]:
+        response = self._request("GET", f"/api/user/{uuid}")
+        if response is None:
+            return None
+        if response.status_code == 404:
+            logger.warning(f"Marzban: User with UUID {uuid} not found.")
+            return None
+        try:
             response.raise_for_status()
-            data = response.json()
-            
-            # Convert bytes to GB
-            usage_gb = data.get('used_traffic', 0) / (1024 ** 3)
-            limit_gb = data.get('data_limit', 0) / (1024 ** 3)
-            
-            return {
-                "current_usage_GB": usage_gb,
-                "usage_limit_GB": limit_gb,
-                "is_active": data.get('status') == 'active'
-            }
-        except requests.exceptions.RequestException as e:
+            return self._norm(response.json())
+        except (requests.exceptions.RequestException, ValueError) as e:
             logger.error(f"Marzban: Failed to get user info for {uuid}: {e}")
-            # If token expired, try to refresh it once
-            if "Token has expired" in str(e):
-                self.access_token = self._get_access_token()
-                return self.get_user_info(uuid) # Retry
             return None
 
-marzban_handler = MarzbanAPIHandler()
\ No newline at end of file
+
+marzban_handler = MarzbanAPIHandler()
@@ -1,3 +1,4 @@
+from typing import Optional
 from telebot import types
 from config import EMOJIS, PAGE_SIZE
 
@@ -93,7 +94,9 @@ class Menu:
         kb.add(btn_back)
         return kb
 
-    def create_pagination_menu(self, base_callback: str, current_page: int, total_items: int, back_callback: str = "admin_reports_menu") -> types.InlineKeyboardMarkup:
+    def create_pagination_menu(self, base_callback: str, current_page: int, total_items: int, back_callback: str = "admin_reports_menu",
+                               prev_cursor: Optional[str] = None, next_cursor: Optional[str] = None) -> types.InlineKeyboardMarkup:
+        # برای لیست‌های صفحه‌بندی شده در دیتابیس، مکان‌نمای صفحه (cursor) بعد از ':' به شماره صفحه اضافه می‌شود
         kb = types.InlineKeyboardMarkup(row_width=2)
         
         back_text_map = {
@@ -109,10 +112,12 @@ class Menu:
 
         nav_buttons = []
         if current_page > 0:
-            nav_buttons.append(types.InlineKeyboardButton("⬅️ قبلی", callback_data=f"{base_callback}_{current_page - 1}"))
+            prev_suffix = f":{prev_cursor}" if prev_cursor else ""
+            nav_buttons.append(types.InlineKeyboardButton("⬅️ قبلی", callback_data=f"{base_callback}_{current_page - 1}{prev_suffix}"))
         
         if (current_page + 1) * PAGE_SIZE < total_items:
-            nav_buttons.append(types.InlineKeyboardButton("بعدی ➡️", callback_data=f"{base_callback}_{current_page + 1}"))
+            next_suffix = f":{next_cursor}" if next_cursor else ""
+            nav_buttons.append(types.InlineKeyboardButton("بعدی ➡️", callback_data=f"{base_callback}_{current_page + 1}{next_suffix}"))
         
         if nav_buttons:
             kb.row(*nav_buttons)
@@ -150,7 +155,8 @@ class Menu:
         kb = types.InlineKeyboardMarkup(row_width=1)
         kb.add(
             types.InlineKeyboardButton("🏆 پرمصرف‌ترین کاربران", callback_data="admin_top_consumers_0"),
-            types.InlineKeyboardButton("🌡️ وضعیت سلامت پنل", callback_data="admin_health_check")
+            types.InlineKeyboardButton("🌡️ وضعیت سلامت پنل", callback_data="admin_health_check"),
+            types.InlineKeyboardButton("📡 آمار تأخیر و خطای API", callback_data="admin_api_stats")
         )
         kb.add(types.InlineKeyboardButton("🔙 بازگشت به پنل مدیریت", callback_data="admin_panel"))
         return kb
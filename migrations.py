@@ -0,0 +1,81 @@
+import logging
+import sqlite3
+from typing import Callable, List, NamedTuple, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    statements: Tuple[Union[str, Callable[[sqlite3.Connection], None]], ...]
+    transactional: bool = True  # False for steps such as VACUUM that cannot run inside a transaction
+
+
+def _enable_incremental_vacuum(conn: sqlite3.Connection) -> None:
+    # Changing auto_vacuum on a database that already has tables only takes effect after a VACUUM.
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+
+
+# Append-only: a deployed migration is never edited, a new version is added instead.
+# The base tables are created by DatabaseManager._init_db; indexes live here.
+MIGRATIONS: List[Migration] = [
+    Migration(1, "covering and partial indexes for hot queries", (
+        # Lookups by uuid already use the UNIQUE constraint's index.
+        "DROP INDEX IF EXISTS idx_user_uuids_uuid",
+        # Active UUIDs of a user in created_at order, and full active-UUID maps, straight from the index.
+        "CREATE INDEX IF NOT EXISTS idx_user_uuids_active ON user_uuids(user_id, created_at, uuid, is_active) WHERE is_active = 1",
+        # Per-account first/last reading and window deltas without touching the table.
+        "DROP INDEX IF EXISTS idx_snapshots_uuid_id_taken_at",
+        "CREATE INDEX IF NOT EXISTS idx_snapshots_uuid_taken_usage ON usage_snapshots(uuid_id, taken_at, usage_gb)",
+        # Time-range reads (today's usage map, rollups) and time-range pruning.
+        "DROP INDEX IF EXISTS idx_snapshots_taken_at",
+        "CREATE INDEX IF NOT EXISTS idx_snapshots_taken_usage ON usage_snapshots(taken_at, uuid_id, usage_gb)",
+    )),
+    # Free pages are then returned in small steps by DatabaseManager.run_maintenance()
+    # instead of a blocking full VACUUM (this one-time VACUUM is the last).
+    Migration(2, "incremental auto_vacuum", (_enable_incremental_vacuum,), transactional=False),
+    # 'MM-DD' of the birthday, so birthday lists and today's birthdays are index lookups.
+    Migration(3, "indexed birthday month-day key", (
+        "ALTER TABLE users ADD COLUMN birthday_md TEXT",
+        "UPDATE users SET birthday_md = strftime('%m-%d', birthday) WHERE birthday IS NOT NULL",
+        "CREATE INDEX IF NOT EXISTS idx_users_birthday_md ON users(birthday_md, user_id) WHERE birthday_md IS NOT NULL",
+    )),
+]
+
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """
+    Applies every migration newer than the database's PRAGMA user_version, each in its own
+    transaction together with the version bump (non-transactional migrations must be
+    idempotent, as they can be re-run if interrupted). Returns the resulting version.
+    """
+    version = schema_version(conn)
+    for migration in MIGRATIONS:
+        if migration.version <= version:
+            continue
+        logger.info(f"Applying schema migration {migration.version}: {migration.description} ...")
+        try:
+            if migration.transactional:
+                conn.execute("BEGIN IMMEDIATE")
+            for statement in migration.statements:
+                if callable(statement):
+                    statement(conn)
+                else:
+                    conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {int(migration.version)}")
+            conn.commit()
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.rollback()
+            logger.error(f"Schema migration {migration.version} ({migration.description}) failed")
+            raise
+        version = migration.version
+        logger.info(f"Applied schema migration {version}: {migration.description}")
+    return version
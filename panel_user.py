@@ -0,0 +1,94 @@
+from collections.abc import MutableMapping
+from datetime import datetime
+from typing import Any, Dict, Iterator, Optional
+import sys
+import pytz
+
+
+class PanelUser(MutableMapping):
+    """
+    Compact, slot-based record for one normalized panel user.
+
+    Behaves like the dict `_norm` used to return (`user['name']`, `user.get('expire')`,
+    `'breakdown' in user`, `dict(user)`), so formatters and handlers keep working unchanged.
+    last_online is stored as a UTC epoch float and only turned into a datetime when read;
+    remaining_GB and usage_percentage are derived on access. Keys that are not part of the
+    record (e.g. 'daily_usage_GB', 'db_id') live in a lazily created side dict.
+    `panel` names the Hiddify panel the user was read from.
+    """
+    __slots__ = ("name", "uuid", "is_active", "last_online_ts", "usage_limit_GB",
+                 "current_usage_GB", "expire", "mode", "panel", "_extra")
+
+    FIELDS = ("name", "uuid", "is_active", "last_online", "usage_limit_GB", "current_usage_GB",
+              "remaining_GB", "usage_percentage", "expire", "mode", "panel")
+    _FIELD_SET = frozenset(FIELDS)
+    _DERIVED = frozenset(("remaining_GB", "usage_percentage"))
+
+    def __init__(self, name: str, uuid: str, is_active: bool, last_online_ts: Optional[float],
+                 usage_limit_GB: float, current_usage_GB: float, expire: Optional[int], mode: str,
+                 panel: Optional[str] = None):
+        self.name = name
+        self.uuid = uuid
+        self.is_active = is_active
+        self.last_online_ts = last_online_ts
+        self.usage_limit_GB = usage_limit_GB
+        self.current_usage_GB = current_usage_GB
+        self.expire = expire
+        self.mode = sys.intern(mode) if isinstance(mode, str) else mode
+        self.panel = panel
+        self._extra: Optional[Dict[str, Any]] = None
+
+    @property
+    def last_online(self) -> Optional[datetime]:
+        ts = self.last_online_ts
+        return None if ts is None else datetime.fromtimestamp(ts, pytz.utc)
+
+    @property
+    def remaining_GB(self) -> float:
+        return max(0, self.usage_limit_GB - self.current_usage_GB)
+
+    @property
+    def usage_percentage(self) -> float:
+        return (self.current_usage_GB / self.usage_limit_GB * 100) if self.usage_limit_GB > 0 else 0
+
+    # --- dict-compatible accessors ---
+    def __getitem__(self, key: str) -> Any:
+        if key in self._FIELD_SET:
+            return getattr(self, key)
+        if self._extra is not None and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key == "last_online":
+            self.last_online_ts = value.timestamp() if value else None
+        elif key in self._DERIVED:
+            raise KeyError(f"'{key}' is derived and cannot be assigned")
+        elif key in self._FIELD_SET:
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __delitem__(self, key: str) -> None:
+        if self._extra is None or key not in self._extra:
+            raise KeyError(key)
+        del self._extra[key]
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self.FIELDS
+        if self._extra:
+            yield from self._extra
+
+    def __len__(self) -> int:
+        return len(self.FIELDS) + (len(self._extra) if self._extra else 0)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._FIELD_SET or (self._extra is not None and key in self._extra)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self.items())
+
+    def __repr__(self) -> str:
+        return f"PanelUser(uuid={self.uuid!r}, name={self.name!r}, usage={self.current_usage_GB:.2f}/{self.usage_limit_GB:.2f}GB)"
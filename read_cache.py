@@ -0,0 +1,54 @@
+import threading
+from typing import Any, Callable, Dict, Hashable
+
+from cachetools import LRUCache
+
+_MISSING = object()
+
+
+class ReadThroughCache:
+    """
+    Thread-safe LRU read-through cache with hit/miss counters.
+
+    Invalidate only after the write is committed. A load that overlaps an invalidation is
+    returned to its caller but not stored, so a value read just before a commit can never
+    outlive it in the cache.
+    """
+
+    def __init__(self, maxsize: int, name: str):
+        self.name = name
+        self._cache = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._invalidations = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, load: Callable[[], Any]) -> Any:
+        with self._lock:
+            value = self._cache.get(key, _MISSING)
+            if value is not _MISSING:
+                self.hits += 1
+                return value
+            self.misses += 1
+            generation = self._invalidations
+        value = load()
+        with self._lock:
+            if generation == self._invalidations:
+                self._cache[key] = value
+        return value
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._invalidations += 1
+            self._cache.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._invalidations += 1
+            self._cache.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"size": len(self._cache), "maxsize": self._cache.maxsize, "hits": self.hits,
+                    "misses": self.misses, "hit_rate": (self.hits / lookups) if lookups else None}
@@ -7,9 +7,10 @@ import pytz
 from telebot import apihelper, TeleBot
 from config import (DAILY_REPORT_TIME, TEHRAN_TZ, ADMIN_IDS,BIRTHDAY_GIFT_GB, BIRTHDAY_GIFT_DAYS, NOTIFY_ADMIN_ON_USAGE,
                      WARNING_USAGE_THRESHOLD,WARNING_DAYS_BEFORE_EXPIRY,
-                     USAGE_WARNING_CHECK_HOURS, ONLINE_REPORT_UPDATE_HOURS)
+                     USAGE_WARNING_CHECK_HOURS, USAGE_WARNING_NOTIFY_ONCE, ONLINE_REPORT_UPDATE_HOURS, DB_MAINTENANCE_INTERVAL_MINUTES)
 from database import db
 from api_handler import api_handler
+from user_changes import ChangeKind
 from utils import escape_markdown
 from menu import menu
 from formatters import fmt_admin_report, fmt_user_report, fmt_online_users_list
@@ -22,31 +23,72 @@ class SchedulerManager:
         self.running = False
         self.tz = pytz.timezone(TEHRAN_TZ) if isinstance(TEHRAN_TZ, str) else TEHRAN_TZ
         self.tz_str = str(self.tz)
+        # UUIDهایی که از آخرین اجرای هر job تغییر کرده‌اند (از رویدادهای دایرکتوری پر می‌شوند)
+        self._changes_lock = threading.Lock()
+        self._usage_changed: set[str] = set()
+        self._crossed_warning: set[str] = set()
+        self._snapshot_day = None
+        self._warnings_seeded = False
+
+    def _on_user_changes(self, changes: list) -> None:
+        """Collects directory change events so jobs only revisit the users that changed."""
+        with self._changes_lock:
+            for change in changes:
+                if change.kind in (ChangeKind.USAGE_CHANGED, ChangeKind.ADDED):
+                    self._usage_changed.add(change.uuid)
+                elif USAGE_WARNING_NOTIFY_ONCE and change.threshold == WARNING_USAGE_THRESHOLD and change.crossed_upward:
+                    self._crossed_warning.add(change.uuid)
+
+    def _take_changes(self, attr: str) -> set[str]:
+        with self._changes_lock:
+            changed = getattr(self, attr)
+            setattr(self, attr, set())
+            return changed
+
+    def _requeue_changes(self, attr: str, uuids: set[str]) -> None:
+        """Puts back changes a failed job run could not process."""
+        with self._changes_lock:
+            getattr(self, attr).update(uuids)
 
     def _hourly_snapshots(self) -> None:
-        """Takes a usage snapshot for all active UUIDs every hour."""
+        """
+        Takes a usage snapshot every hour. The first run of each Tehran day covers all active
+        UUIDs (the day's baseline); later runs only those whose usage changed since the last run.
+        """
         logger.info("Scheduler: Running hourly usage snapshot job.")
-        
-        all_users_info = api_handler.get_all_users()
-        if not all_users_info:
+
+        api_handler.directory.ensure_fresh()
+        changed = self._take_changes('_usage_changed')
+        user_info_map = api_handler.directory.store().by_uuid
+        if not user_info_map:
             return
-            
-        user_info_map = {user['uuid']: user for user in all_users_info}
 
         all_uuids_from_db = db.all_active_uuids()
         if not all_uuids_from_db:
             return
 
+        today = datetime.now(self.tz).date()
+        full_run = self._snapshot_day != today
+        self._snapshot_day = today
+
+        rows = []
         for u_row in all_uuids_from_db:
-            try:
-                uuid_str = u_row['uuid']
-                if uuid_str in user_info_map:
-                    info = user_info_map[uuid_str]
-                    if info.get('current_usage_GB') is not None:
-                        db.add_usage_snapshot(u_row['id'], info['current_usage_GB'])
-                
-            except Exception as e:
-                logger.error(f"Scheduler: Failed to process snapshot for uuid_id {u_row['id']}: {e}")
+            uuid_str = u_row['uuid']
+            if not full_run and uuid_str not in changed:
+                continue
+            info = user_info_map.get(uuid_str)
+            if info is not None and info.get('current_usage_GB') is not None:
+                rows.append((u_row['id'], info['current_usage_GB']))
+
+        try:
+            written = db.add_usage_snapshots_bulk(rows)
+            logger.info(f"Scheduler: Stored {written} usage snapshots ({'full' if full_run else 'changed only'}).")
+        except Exception as e:
+            logger.error(f"Scheduler: Failed to store {len(rows)} usage snapshots: {e}")
+            if not full_run:
+                self._requeue_changes('_usage_changed', changed)
+            else:
+                self._snapshot_day = None  # retry the day's baseline on the next run
 
     def _check_usage_warnings(self) -> None:
         """
@@ -59,18 +101,31 @@ class SchedulerManager:
             return
             
         logger.info("Scheduler: Running usage warning check.")
-        all_users = api_handler.get_all_users()
-        if not all_users: return
+        api_handler.directory.ensure_fresh()
+        crossed = self._take_changes('_crossed_warning')
+        store = api_handler.directory.store()
+        if not store.users:
+            self._requeue_changes('_crossed_warning', crossed)
+            return
         
         # ✅ [FIXED] استفاده از متغیر صحیح از فایل کانفیگ
         threshold = WARNING_USAGE_THRESHOLD
-        
+
+        # گزارش دوره‌ای همه کاربران بالای آستانه را شامل می‌شود. با USAGE_WARNING_NOTIFY_ONCE
+        # اجرای اول همه را بررسی می‌کند و بعد از آن فقط کاربرانی که از آستانه عبور کرده‌اند
+        if USAGE_WARNING_NOTIFY_ONCE and self._warnings_seeded:
+            candidates = [store.by_uuid[uuid] for uuid in crossed if uuid in store.by_uuid]
+        else:
+            candidates = store.users
+
         users_to_warn = [
-            u for u in all_users 
+            u for u in candidates
             if u.get('is_active') and threshold <= u.get('usage_percentage', 0) < 100
         ]
 
-        if not users_to_warn: return
+        if not users_to_warn:
+            self._warnings_seeded = True
+            return
 
         message_lines = [f"⚠️ *هشدار مصرف بالا \\(بیش از {threshold}%\\)*\n"]
         for user in users_to_warn:
@@ -80,12 +135,18 @@ class SchedulerManager:
         
         full_message = "\n".join(message_lines)
         
+        delivered = False
         for admin_id in ADMIN_IDS:
             try:
                 self.bot.send_message(admin_id, full_message, parse_mode="MarkdownV2")
+                delivered = True
                 time.sleep(0.2)
             except Exception as e:
                 logger.error(f"Scheduler: Failed to send usage warning to admin {admin_id}: {e}")
+        if delivered:
+            self._warnings_seeded = True
+        else:
+            self._requeue_changes('_crossed_warning', crossed)  # در اجرای بعدی دوباره گزارش شوند
 
     def _check_expiry_warnings(self) -> None:
         """Sends expiry warnings to users whose accounts are expiring soon."""
@@ -137,12 +198,13 @@ class SchedulerManager:
         now_str = now.strftime("%Y/%m/%d - %H:%M")
         logger.info(f"Scheduler: Running nightly reports at {now_str}")
 
-        all_users_info_from_api = api_handler.get_all_users()
+        store = api_handler.directory.store()
+        all_users_info_from_api = store.users
         if not all_users_info_from_api:
             logger.warning("Scheduler: Could not fetch user info from API for nightly report.")
             return
             
-        user_info_map = {user['uuid']: user for user in all_users_info_from_api}
+        user_info_map = store.by_uuid
         all_bot_users = db.get_all_user_ids()
         separator = '\n' + '\\-' * 25 + '\n'
 
@@ -171,14 +233,9 @@ class SchedulerManager:
                 if report_text:
                     self.bot.send_message(user_id, header + report_text, parse_mode="MarkdownV2")
                     time.sleep(0.5)
-                
-                if user_infos_for_report:
-                    for info in user_infos_for_report:
-                        db.delete_user_snapshots(info['db_id'])
-                    logger.info(f"Scheduler: Cleaned up daily snapshots for user {user_id}.")
-                    
+
             except Exception as e:
-                logger.error(f"Scheduler: Failed to send nightly report or cleanup for user {user_id}: {e}")
+                logger.error(f"Scheduler: Failed to send nightly report for user {user_id}: {e}")
                 continue
 
     def _update_online_reports(self) -> None:
@@ -186,19 +243,22 @@ class SchedulerManager:
         logger.info("Scheduler: Running 3-hourly online user report update.")
         
         messages_to_update = db.get_scheduled_messages('online_users_report')
+        if not messages_to_update:
+            return
+
+        # لیست و مصرف امروز یک بار ساخته می‌شود و برای همه پیام‌ها استفاده می‌شود
+        online_list = api_handler.online_users()
+        daily_usage_map = db.get_daily_usage_map(user['uuid'] for user in online_list)
+        for user in online_list:
+            user['daily_usage_GB'] = daily_usage_map.get(user['uuid'], 0.0)
+        text = fmt_online_users_list(online_list, 0)
+        kb = menu.create_pagination_menu("admin_online", 0, len(online_list))
         
         for msg_info in messages_to_update:
             try:
                 chat_id = msg_info['chat_id']
                 message_id = msg_info['message_id']
                 
-                online_list = api_handler.online_users()
-                for user in online_list:
-                    user['daily_usage_GB'] = db.get_usage_since_midnight_by_uuid(user['uuid'])
-                
-                text = fmt_online_users_list(online_list, 0)
-                kb = menu.create_pagination_menu("admin_online", 0, len(online_list))
-                
                 self.bot.edit_message_text(text, chat_id, message_id, reply_markup=kb, parse_mode="MarkdownV2")
                 time.sleep(0.5)
             except apihelper.ApiTelegramException as e:
@@ -218,17 +278,16 @@ class SchedulerManager:
             logger.info("Scheduler: No birthdays today.")
             return
 
-        for user_id in today_birthday_users:
-            user_uuids = db.uuids(user_id)
+        gift = {"add_usage_gb": BIRTHDAY_GIFT_GB, "add_days": BIRTHDAY_GIFT_DAYS}
+        uuids_by_user = {user_id: [row['uuid'] for row in db.uuids(user_id)] for user_id in today_birthday_users}
+        all_uuids = dict.fromkeys(uuid for user_uuids in uuids_by_user.values() for uuid in user_uuids)
+        results = api_handler.bulk_modify_users((uuid, gift) for uuid in all_uuids)
+
+        for user_id, user_uuids in uuids_by_user.items():
             if not user_uuids:
                 continue
-            
-            gift_applied = False
-            for row in user_uuids:
-                uuid = row['uuid']
-                # ✅ [FIXED] فراخوانی مستقیم api_handler به جای self.api_handler
-                if api_handler.modify_user(uuid, add_usage_gb=BIRTHDAY_GIFT_GB, add_days=BIRTHDAY_GIFT_DAYS):
-                    gift_applied = True
+
+            gift_applied = any(results[uuid].ok for uuid in user_uuids if uuid in results)
             
             if gift_applied:
                 try:
@@ -244,30 +303,41 @@ class SchedulerManager:
                 except Exception as e:
                     logger.error(f"Scheduler: Failed to send birthday message to user {user_id}: {e}")
 
-    def _run_monthly_vacuum(self) -> None:
-        """A scheduled job to run the VACUUM command on the database."""
-        today = datetime.now(self.tz)
-        if today.day == 1:
-            logger.info("Scheduler: It's the first of the month, running database VACUUM job.")
-            try:
-                db.vacuum_db()
-                logger.info("Scheduler: Database VACUUM completed successfully.")
-            except Exception as e:
-                logger.error(f"Scheduler: Database VACUUM failed: {e}")
+    def _usage_rollup(self) -> None:
+        """Rolls raw usage snapshots up into hourly/daily totals and applies the retention limits."""
+        try:
+            rolled = db.rollup_usage()
+            pruned = db.prune_usage_history()
+            logger.info(f"Scheduler: Usage rollup done ({rolled['snapshots']} snapshots -> {rolled['hours']} hours, "
+                        f"{rolled['days']} days); pruned raw={pruned['raw']}, hourly={pruned['hourly']}, daily={pruned['daily']}.")
+        except Exception as e:
+            logger.error(f"Scheduler: Usage rollup failed: {e}", exc_info=True)
+
+    def _db_maintenance(self) -> None:
+        """Reclaims a bounded number of free pages and checkpoints the WAL when writes are quiet."""
+        try:
+            stats = db.run_maintenance()
+            if stats["last_reclaimed"]:
+                logger.info(f"Scheduler: DB maintenance reclaimed {stats['last_reclaimed']} pages "
+                            f"({stats['freelist_count']} free left) in {stats['last_run_seconds']:.3f}s.")
+        except Exception as e:
+            logger.error(f"Scheduler: DB maintenance failed: {e}")
 
     def start(self) -> None:
         if self.running: return
         
         report_time_str = DAILY_REPORT_TIME.strftime("%H:%M")
         schedule.every().hour.at(":01").do(self._hourly_snapshots)
+        schedule.every().hour.at(":40").do(self._usage_rollup)
         schedule.every(USAGE_WARNING_CHECK_HOURS).hours.do(self._check_usage_warnings)
         schedule.every().day.at("23:55", self.tz_str).do(self._check_expiry_warnings)
         schedule.every().day.at("11:59", self.tz_str).do(self._nightly_report)
         schedule.every().day.at(report_time_str, self.tz_str).do(self._nightly_report)
         schedule.every(ONLINE_REPORT_UPDATE_HOURS).hours.do(self._update_online_reports)
         schedule.every().day.at("00:05", self.tz_str).do(self._birthday_gifts_job)
-        schedule.every().day.at("04:00").do(self._run_monthly_vacuum)
+        schedule.every(DB_MAINTENANCE_INTERVAL_MINUTES).minutes.do(self._db_maintenance)
         
+        api_handler.directory.subscribe(self._on_user_changes)
         self.running = True
         threading.Thread(target=self._runner, daemon=True).start()
         logger.info(f"Scheduler started. Nightly report at {report_time_str} ({self.tz_str}). Online user reports will update every 3 hours && Birthday gift job scheduled for 00:05 ({self.tz_str}")
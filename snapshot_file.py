@@ -0,0 +1,145 @@
+import logging
+import math
+import os
+import struct
+import sys
+from array import array
+from datetime import datetime
+from typing import List, Optional, Sequence, Tuple
+
+from config import TEHRAN_TZ
+from panel_user import PanelUser
+
+logger = logging.getLogger(__name__)
+
+# Layout (little-endian): header, then one column after another.
+#   header : magic, version, fetched_at (epoch seconds), user count
+#   strings: name / uuid as (uint32 offsets[count + 1], utf-8 blob)
+#   labels : mode / panel dictionary-encoded as (string table, uint16 codes[count])
+#   numbers: is_active int8, last_online float64 (NaN = never), usage limit/current float64,
+#            expiry int32 as an absolute Tehran day ordinal (INT32_MIN = unlimited)
+_MAGIC = b"HDSN"
+_VERSION = 1
+_HEADER = struct.Struct("<4sHdI")
+_NO_EXPIRY = -2 ** 31
+
+
+def _day_ordinal(ts: float) -> int:
+    return datetime.fromtimestamp(ts, TEHRAN_TZ).toordinal()
+
+
+def _native(values: array) -> bytes:
+    if sys.byteorder != "little":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _read_array(typecode: str, data: memoryview, offset: int, count: int) -> Tuple[array, int]:
+    values = array(typecode)
+    end = offset + count * values.itemsize
+    values.frombytes(data[offset:end])
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values, end
+
+
+def _pack_strings(strings: Sequence[str]) -> bytes:
+    blobs = [s.encode("utf-8") for s in strings]
+    offsets = array("I", [0])
+    for blob in blobs:
+        offsets.append(offsets[-1] + len(blob))
+    return _native(offsets) + b"".join(blobs)
+
+
+def _unpack_strings(data: memoryview, offset: int, count: int) -> Tuple[List[str], int]:
+    offsets, offset = _read_array("I", data, offset, count + 1)
+    blob = bytes(data[offset:offset + offsets[-1]])
+    strings = [blob[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(count)]
+    return strings, offset + offsets[-1]
+
+
+def _pack_labels(labels: Sequence[Optional[str]]) -> bytes:
+    table: List[str] = []
+    index = {}
+    codes = array("H")
+    for label in labels:
+        key = "" if label is None else label
+        if key not in index:
+            index[key] = len(table)
+            table.append(key)
+        codes.append(index[key])
+    return struct.pack("<H", len(table)) + _pack_strings(table) + _native(codes)
+
+
+def _unpack_labels(data: memoryview, offset: int, count: int) -> Tuple[List[Optional[str]], int]:
+    (table_size,) = struct.unpack_from("<H", data, offset)
+    table, offset = _unpack_strings(data, offset + 2, table_size)
+    table = [sys.intern(label) if label else None for label in table]
+    codes, offset = _read_array("H", data, offset, count)
+    return [table[code] for code in codes], offset
+
+
+def write_snapshot(path: str, users: Sequence[PanelUser], fetched_at: float) -> None:
+    """Writes the snapshot column by column and atomically replaces `path`."""
+    day = _day_ordinal(fetched_at)
+    parts = [
+        _HEADER.pack(_MAGIC, _VERSION, fetched_at, len(users)),
+        _pack_strings([u.name for u in users]),
+        _pack_strings([u.uuid for u in users]),
+        _pack_labels([u.mode for u in users]),
+        _pack_labels([u.panel for u in users]),
+        _native(array("b", [1 if u.is_active else 0 for u in users])),
+        _native(array("d", [math.nan if u.last_online_ts is None else u.last_online_ts for u in users])),
+        _native(array("d", [u.usage_limit_GB for u in users])),
+        _native(array("d", [u.current_usage_GB for u in users])),
+        _native(array("i", [_NO_EXPIRY if u.expire is None else day + u.expire for u in users])),
+    ]
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(b"".join(parts))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_snapshot(path: str) -> Optional[Tuple[List[PanelUser], float]]:
+    """
+    Loads a snapshot written by write_snapshot. As in a live snapshot, `expire` counts days
+    from the snapshot's own fetch date. Returns None if the file is missing or unreadable.
+    """
+    try:
+        with open(path, "rb") as f:
+            data = memoryview(f.read())
+        magic, version, fetched_at, count = _HEADER.unpack_from(data, 0)
+        if magic != _MAGIC or version != _VERSION:
+            logger.warning(f"Ignoring snapshot file {path}: unknown format")
+            return None
+        offset = _HEADER.size
+        names, offset = _unpack_strings(data, offset, count)
+        uuids, offset = _unpack_strings(data, offset, count)
+        modes, offset = _unpack_labels(data, offset, count)
+        panels, offset = _unpack_labels(data, offset, count)
+        active, offset = _read_array("b", data, offset, count)
+        last_online, offset = _read_array("d", data, offset, count)
+        limits, offset = _read_array("d", data, offset, count)
+        usages, offset = _read_array("d", data, offset, count)
+        expiries, offset = _read_array("i", data, offset, count)
+        if offset != len(data):
+            raise ValueError(f"size mismatch ({offset} != {len(data)})")
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, struct.error, UnicodeDecodeError, IndexError) as e:
+        logger.warning(f"Ignoring unreadable snapshot file {path}: {e}")
+        return None
+
+    day = _day_ordinal(fetched_at)
+    users = [
+        PanelUser(name=names[i], uuid=uuids[i], is_active=bool(active[i]),
+                  last_online_ts=None if math.isnan(last_online[i]) else last_online[i],
+                  usage_limit_GB=limits[i], current_usage_GB=usages[i],
+                  expire=None if expiries[i] == _NO_EXPIRY else expiries[i] - day,
+                  mode=modes[i] or "no_reset", panel=panels[i])
+        for i in range(count)
+    ]
+    return users, fetched_at
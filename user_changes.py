@@ -0,0 +1,80 @@
+from datetime import datetime
+from enum import Enum
+from typing import List, NamedTuple, Optional, Sequence
+
+from config import TEHRAN_TZ, USAGE_EVENT_THRESHOLDS
+from panel_user import PanelUser
+from user_store import UserStore
+
+ONLINE_WINDOW_SECONDS = 3 * 60
+
+
+class ChangeKind(Enum):
+    ADDED = "added"
+    REMOVED = "removed"
+    USAGE_CHANGED = "usage_changed"
+    CAME_ONLINE = "came_online"
+    WENT_OFFLINE = "went_offline"
+    THRESHOLD_CROSSED = "threshold_crossed"
+    EXPIRY_CHANGED = "expiry_changed"
+
+
+class UserChange(NamedTuple):
+    """One difference between two successive directory snapshots."""
+    kind: ChangeKind
+    uuid: str
+    old: Optional[PanelUser]
+    new: Optional[PanelUser]
+    threshold: Optional[float] = None  # only set for THRESHOLD_CROSSED
+
+    @property
+    def crossed_upward(self) -> bool:
+        return (self.kind is ChangeKind.THRESHOLD_CROSSED and self.new is not None
+                and self.new.usage_percentage >= self.threshold)
+
+
+def _is_online(user: PanelUser, at_ts: float) -> bool:
+    return bool(user.is_active and user.last_online_ts is not None
+                and user.last_online_ts >= at_ts - ONLINE_WINDOW_SECONDS)
+
+
+def diff_snapshots(old: UserStore, new: UserStore, old_ts: float, new_ts: float,
+                   thresholds: Sequence[float] = USAGE_EVENT_THRESHOLDS) -> List[UserChange]:
+    """
+    Compares two snapshots user by user. Online state is evaluated at each snapshot's own
+    fetch time, so a user who simply stopped connecting shows up as WENT_OFFLINE.
+    """
+    changes: List[UserChange] = []
+    old_day = datetime.fromtimestamp(old_ts, TEHRAN_TZ).toordinal()
+    new_day = datetime.fromtimestamp(new_ts, TEHRAN_TZ).toordinal()
+    old_by_uuid = old.by_uuid
+    for uuid, user in new.by_uuid.items():
+        prev = old_by_uuid.get(uuid)
+        if prev is None:
+            changes.append(UserChange(ChangeKind.ADDED, uuid, None, user))
+            continue
+
+        if user.current_usage_GB != prev.current_usage_GB:
+            changes.append(UserChange(ChangeKind.USAGE_CHANGED, uuid, prev, user))
+
+        was_online, is_online = _is_online(prev, old_ts), _is_online(user, new_ts)
+        if is_online and not was_online:
+            changes.append(UserChange(ChangeKind.CAME_ONLINE, uuid, prev, user))
+        elif was_online and not is_online:
+            changes.append(UserChange(ChangeKind.WENT_OFFLINE, uuid, prev, user))
+
+        old_pct, new_pct = prev.usage_percentage, user.usage_percentage
+        if old_pct != new_pct:
+            for threshold in thresholds:
+                if (old_pct < threshold) != (new_pct < threshold):
+                    changes.append(UserChange(ChangeKind.THRESHOLD_CROSSED, uuid, prev, user, threshold))
+
+        # `expire` counts days from the snapshot's own date, so compare absolute expiry days.
+        if (user.expire is None) != (prev.expire is None) or (
+                user.expire is not None and user.expire + new_day != prev.expire + old_day):
+            changes.append(UserChange(ChangeKind.EXPIRY_CHANGED, uuid, prev, user))
+
+    for uuid, prev in old_by_uuid.items():
+        if uuid not in new.by_uuid:
+            changes.append(UserChange(ChangeKind.REMOVED, uuid, prev, None))
+    return changes
@@ -0,0 +1,192 @@
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from config import USER_DIRECTORY_TTL, USER_DIRECTORY_RETRY_SECONDS, USER_DIRECTORY_WAIT_TIMEOUT
+from snapshot_file import read_snapshot, write_snapshot
+from user_store import UserStore
+
+logger = logging.getLogger(__name__)
+
+
+class UserDirectory:
+    """
+    Shared snapshot of every panel user, refreshed in the background.
+
+    - Concurrent callers never trigger more than one download at a time (single-flight).
+    - Once a snapshot exists it is always served immediately; an expired snapshot is returned
+      as-is while a background refresh replaces it (stale-while-revalidate).
+    - A failed refresh keeps the last good snapshot, so a panel outage degrades to old data
+      instead of empty reports.
+    - Every snapshot is indexed once (see UserStore) so queries don't rescan the list.
+    - If a `diff` function is given, each new snapshot is compared with the previous one and
+      the resulting change list is passed to every subscriber before refresh() returns.
+    - With a `snapshot_path`, every good snapshot is saved to disk and the last one is loaded
+      at construction, so a restarted bot has data (marked `restored`, with its real age)
+      before the panel answers.
+    """
+
+    def __init__(self, fetch: Callable[[], Optional[List[Dict[str, Any]]]], ttl: float = USER_DIRECTORY_TTL,
+                 name: str = "hiddify", build: Callable[[List[Dict[str, Any]]], Any] = UserStore,
+                 diff: Optional[Callable[[Any, Any, float, float], List[Any]]] = None,
+                 snapshot_path: Optional[str] = None):
+        # `fetch` must return None on failure and a (possibly empty) list on success.
+        self._fetch = fetch
+        self._build = build
+        self._diff = diff
+        self._subscribers: List[Callable[[List[Any]], None]] = []
+        self.ttl = ttl
+        self.name = name
+        self._lock = threading.Lock()
+        self._store = build([])
+        self._fetched_at: Optional[float] = None
+        self._failed_at: Optional[float] = None
+        self._inflight: Optional[threading.Event] = None
+        self._snapshot_path = snapshot_path
+        self.restored = False  # True while serving the snapshot loaded from disk
+        if snapshot_path:
+            self._load_snapshot()
+
+    def users(self) -> List[Dict[str, Any]]:
+        """Returns the current snapshot, waiting only if no snapshot has ever been loaded."""
+        return self.store().users
+
+    def store(self) -> Any:
+        """Returns the indexed current snapshot, waiting only if no snapshot has ever been loaded."""
+        with self._lock:
+            has_snapshot = self._fetched_at is not None
+            event = self._inflight
+            if self._needs_refresh_locked():
+                event = self._start_refresh_locked()
+        if not has_snapshot and event is not None:
+            event.wait(USER_DIRECTORY_WAIT_TIMEOUT)
+        return self._store
+
+    def snapshot(self) -> Tuple[Any, Optional[float]]:
+        """Like store(), but also returns the fetch time of that same snapshot."""
+        self.store()
+        with self._lock:
+            return self._store, self._fetched_at
+
+    def peek(self) -> Tuple[Any, Optional[float]]:
+        """Current store and its fetch time, without waiting or starting a refresh."""
+        with self._lock:
+            return self._store, self._fetched_at
+
+    def refresh(self, wait: bool = True, timeout: Optional[float] = USER_DIRECTORY_WAIT_TIMEOUT) -> bool:
+        """Forces a refresh (joining one already in flight). Returns True if a snapshot is available."""
+        with self._lock:
+            event = self._inflight or self._start_refresh_locked()
+        if wait:
+            event.wait(timeout)
+        return self._fetched_at is not None
+
+    def refresh_in_background(self) -> None:
+        """Starts a refresh without waiting, if one is due (respecting the failure backoff)."""
+        with self._lock:
+            if self._needs_refresh_locked():
+                self._start_refresh_locked()
+
+    def ensure_fresh(self, timeout: Optional[float] = USER_DIRECTORY_WAIT_TIMEOUT) -> bool:
+        """Refreshes synchronously only if the snapshot is older than the TTL."""
+        return self.refresh(timeout=timeout) if self.is_stale() else True
+
+    def age(self) -> Optional[float]:
+        """Seconds since the current snapshot was fetched, or None if there is none yet."""
+        fetched_at = self._fetched_at
+        return None if fetched_at is None else max(0.0, time.time() - fetched_at)
+
+    def is_stale(self) -> bool:
+        age = self.age()
+        return age is None or age >= self.ttl
+
+    @property
+    def fetched_at(self) -> Optional[float]:
+        return self._fetched_at
+
+    def subscribe(self, callback: Callable[[List[Any]], None]) -> None:
+        """Registers `callback(changes)`, called on the refresh thread after every successful refresh."""
+        self._subscribers.append(callback)
+
+    def _needs_refresh_locked(self) -> bool:
+        if self._inflight is not None:
+            return False
+        now = time.time()
+        if self._failed_at is not None and now - self._failed_at < USER_DIRECTORY_RETRY_SECONDS:
+            return False
+        return self._fetched_at is None or now - self._fetched_at >= self.ttl
+
+    def _start_refresh_locked(self) -> threading.Event:
+        event = threading.Event()
+        self._inflight = event
+        threading.Thread(target=self._run_refresh, args=(event,), name=f"{self.name}-directory-refresh", daemon=True).start()
+        return event
+
+    def _run_refresh(self, event: threading.Event) -> None:
+        started = time.time()
+        users, store = None, None
+        try:
+            users = self._fetch()
+            if users is not None:
+                store = self._build(users)
+        except Exception as e:
+            logger.error(f"UserDirectory[{self.name}]: refresh failed: {e}")
+            users = None
+        with self._lock:
+            previous_store, previous_at = self._store, self._fetched_at
+            if users is not None:
+                self._store = store
+                self._fetched_at = started
+                self._failed_at = None
+                self.restored = False
+            else:
+                self._failed_at = time.time()
+            self._inflight = None
+        try:
+            if users is not None and self._snapshot_path:
+                self._save_snapshot(users, started)
+            if users is not None and previous_at is not None:
+                self._publish_changes(previous_store, store, previous_at, started)
+            if users is None:
+                age = self.age()
+                logger.warning(f"UserDirectory[{self.name}]: refresh failed, serving snapshot aged "
+                               f"{'n/a' if age is None else f'{age:.0f}s'}")
+            else:
+                logger.debug(f"UserDirectory[{self.name}]: loaded {len(users)} users in {time.time() - started:.2f}s")
+        finally:
+            event.set()  # waiters must never hang on a refresh whose bookkeeping failed
+
+    def _load_snapshot(self) -> None:
+        started = time.time()
+        loaded = read_snapshot(self._snapshot_path)
+        if loaded is None:
+            return
+        users, fetched_at = loaded
+        self._store = self._build(users)
+        self._fetched_at = fetched_at
+        self.restored = True
+        logger.info(f"UserDirectory[{self.name}]: restored {len(users)} users from {self._snapshot_path} "
+                    f"(aged {time.time() - fetched_at:.0f}s) in {time.time() - started:.3f}s")
+
+    def _save_snapshot(self, users: List[Any], fetched_at: float) -> None:
+        try:
+            write_snapshot(self._snapshot_path, users, fetched_at)
+        except Exception as e:  # e.g. OverflowError from a fixed-width column; the refresh itself succeeded
+            logger.warning(f"UserDirectory[{self.name}]: could not save snapshot to {self._snapshot_path}: {e}")
+
+    def _publish_changes(self, old_store: Any, new_store: Any, old_ts: float, new_ts: float) -> None:
+        if self._diff is None or not self._subscribers:
+            return
+        try:
+            changes = self._diff(old_store, new_store, old_ts, new_ts)
+        except Exception as e:
+            logger.error(f"UserDirectory[{self.name}]: snapshot diff failed: {e}")
+            return
+        if not changes:
+            return
+        for callback in list(self._subscribers):
+            try:
+                callback(changes)
+            except Exception as e:
+                logger.error(f"UserDirectory[{self.name}]: change subscriber {callback!r} failed: {e}")
@@ -1,9 +1,10 @@
 import logging
 from telebot import types, telebot
 from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
-from config import ADMIN_IDS, CUSTOM_SUB_LINK_BASE_URL, EMOJIS
+from config import ADMIN_IDS, CUSTOM_SUB_LINK_BASE_URL, EMOJIS, DB_WRITE_ACK_TIMEOUT
 from database import db
 from api_handler import api_handler
+from account_service import account_service
 from menu import menu
 from utils import validate_uuid, escape_markdown, shamsi_to_gregorian, load_custom_links
 from formatters import fmt_one, quick_stats, fmt_service_plans
@@ -144,7 +145,7 @@ def handle_user_callbacks(call: types.CallbackQuery):
     if data.startswith("acc_"):
         uuid_id = int(data.split("_")[1])
         row = db.uuid_by_id(uid, uuid_id)
-        if row and (info := api_handler.user_info(row["uuid"])):
+        if row and (info := account_service.get(row["uuid"])):
             daily_usage = db.get_usage_since_midnight(uuid_id)
             text = fmt_one(info, daily_usage)
             _safe_edit(uid, msg_id, text, reply_markup=menu.account_menu(uuid_id))
@@ -152,7 +153,11 @@ def handle_user_callbacks(call: types.CallbackQuery):
     elif data.startswith("toggle_"):
         setting_key = data.replace("toggle_", "")
         current_settings = db.get_user_settings(uid)
-        db.update_user_setting(uid, setting_key, not current_settings.get(setting_key, True))
+        new_value = not current_settings.get(setting_key, True)
+        write = db.update_user_setting(uid, setting_key, new_value)
+        if write is not None:
+            # تا ثبت شدن صبر می‌کنیم تا لمس بعدی مقدار جدید را بخواند، نه ردیف قدیمی کش‌شده را
+            write.result(DB_WRITE_ACK_TIMEOUT)
         _safe_edit(uid, msg_id, "⚙️ *تنظیمات شما به‌روز شد*", reply_markup=menu.settings(db.get_user_settings(uid)))
 
     elif data.startswith("getlinks_"):
@@ -193,8 +198,7 @@ def handle_user_callbacks(call: types.CallbackQuery):
     elif data.startswith("win_"):
         uuid_id = int(data.split("_")[1])
         txt = ["*مصرف در بازه‌های زمانی اخیر*\n"]
-        for h in (3, 6, 12, 24):
-            usage = db.window_usage(uuid_id, h)
+        for h, usage in db.window_usages(uuid_id, (3, 6, 12, 24)).items():
             txt.append(f"• `{h:>2} ساعت گذشته:` `{usage:.2f} GB`")
         _safe_edit(uid, msg_id, "\n".join(txt), reply_markup=menu.account_menu(uuid_id))
 
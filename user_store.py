@@ -0,0 +1,54 @@
+from bisect import bisect_left, bisect_right
+from operator import attrgetter
+from typing import Dict, List, Optional
+
+from panel_user import PanelUser
+
+
+class UserStore:
+    """
+    Read-only indexes over one snapshot of panel users, built once per directory refresh.
+
+    - `by_uuid`: hash index for O(1) lookups.
+    - last_online: users ordered by their last connection (UTC epoch seconds), so time-range
+      queries are two bisects plus the size of the result.
+    - `by_usage`: users ordered by current usage, highest first.
+    """
+
+    def __init__(self, users: List[PanelUser]):
+        self.users = users
+        self.by_uuid: Dict[str, PanelUser] = {u.uuid: u for u in users}
+
+        seen = sorted((u for u in users if u.last_online_ts is not None), key=attrgetter('last_online_ts'))
+        self._online_keys: List[float] = [u.last_online_ts for u in seen]
+        self._by_last_online: List[PanelUser] = seen
+        self.never_online: List[PanelUser] = [u for u in users if u.last_online_ts is None]
+
+        self.by_usage: List[PanelUser] = sorted(users, key=attrgetter('current_usage_GB'), reverse=True)
+
+    def __len__(self) -> int:
+        return len(self.users)
+
+    def get(self, uuid: str) -> Optional[PanelUser]:
+        return self.by_uuid.get(uuid.lower()) if uuid else None
+
+    def seen_since(self, since_ts: float) -> List[PanelUser]:
+        """Users whose last_online is at or after `since_ts`, most recent first."""
+        start = bisect_left(self._online_keys, since_ts)
+        return self._by_last_online[start:][::-1]
+
+    def seen_between(self, after_ts: float, until_ts: float) -> List[PanelUser]:
+        """Users whose last_online is in (after_ts, until_ts], most recent first."""
+        start = bisect_right(self._online_keys, after_ts)
+        end = bisect_right(self._online_keys, until_ts)
+        return self._by_last_online[start:end][::-1]
+
+    def search(self, query: str) -> Optional[PanelUser]:
+        """Exact UUID match through the index, otherwise the first user whose name contains `query`."""
+        query = query.strip().lower()
+        if not query:
+            return None
+        found = self.by_uuid.get(query)
+        if found:
+            return found
+        return next((u for u in self.users if query in u.name.lower()), None)